@@ -0,0 +1,60 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import argparse
+import logging
+
+from manrs import settings
+from manrs.data_sources.bgpstream import BGPStreamArchiveSourceData
+from manrs.util import configure_logging
+
+
+def parse_cmd():
+    """
+    Parse command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Archive the events of the live BGPStream feed in daily "
+                    "gzip compressed NDJSON files.")
+    parser.add_argument(
+        "-d", "--days", type=int, default=2,
+        help="Number of past days to download (default 2). Should cover "
+             "the time since the last run. Extended to still ongoing "
+             "archived events.")
+    parser.add_argument(
+        "-a", "--archive-dir", default=settings.BGPSTREAM_ARCHIVE_DIRECTORY,
+        help="Archive directory (default BGPSTREAM_ARCHIVE_DIRECTORY from "
+             "the settings).")
+    parser.add_argument("-v", "--verbosity",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Set the logging level: {debug, info, warning(default), "
+        "error, critical}")
+
+    args = parser.parse_args()
+    if not args.archive_dir:
+        raise argparse.ArgumentTypeError("No archive directory given!")
+    if args.days < 1:
+        raise argparse.ArgumentTypeError(
+            "At least one day needs to be downloaded!")
+    return args
+
+
+def main():
+    """
+    Download the latest events and merge them in the archive.
+
+    """
+    args = parse_cmd()
+    configure_logging(args.verbosity)
+    archive = BGPStreamArchiveSourceData(args.archive_dir)
+    archive.update(args.days)
+    logging.info("Finished")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logging.critical("Execution failed!")
+        logging.critical("{}: {}".format(e.__class__.__name__, e))
@@ -7,15 +7,23 @@ import logging
 import os
 import statistics
 import json
+import sys
 
 from sqlalchemy.orm import sessionmaker
 
 from manrs import settings
-from manrs.data_sources.bgpstream import BGPStreamSourceData
-from manrs.data_sources.ripestat import RIPEstatSourceData
-from manrs.data_sources.cidr import CIDRSourceData
-from manrs.util import get_manrs_participants, WeightGeneratorFactory
-from manrs.metrics import get_results_per_asn
+from manrs.data_sources.bgpstream import get_bgp_stream_source
+from manrs.data_sources.ripestat import (
+    RIPEstatCache, RIPEstatCheckpoint, RIPEstatSourceData)
+from manrs.data_sources.rpsl import RPSLRoutingSourceData, RPSLSourceData
+from manrs.data_sources.cidr import (
+    CIDRSourceData, CIDRDBSourceData, CIDRValidationError)
+from manrs.incremental import IncrementalState, IncrementalStateError
+from manrs.util import (
+    WeightGeneratorFactory, configure_logging, get_asns, get_month,
+    parse_date)
+from manrs.metrics import (
+    PrecomputedMetric, get_results_per_asn, register_metric)
 from manrs.models import Report, ReportType, Result, GlobalStats
 import config
 
@@ -63,17 +71,35 @@ def parse_cmd():
                 "When specifiying start and end dates both need to be "
                 "specified!")
 
-    def parse_date(string):
+    def parse_date_arg(string):
         """
         Parse date in YYYYmmdd format.
 
         """
         try:
-            return datetime.strptime(string, "%Y%m%d")
-        except Exception:
+            return parse_date(string)
+        except ValueError:
             raise argparse.ArgumentTypeError(
                 "Invalid date. Date needs to be in YYYYmmdd format.")
 
+    def parse_period_length(string):
+        """
+        Parse the length of the backfill periods; 'month' or a number of
+        days.
+
+        """
+        if string == "month":
+            return string
+        try:
+            days = int(string)
+        except ValueError:
+            days = 0
+        if days < 1:
+            raise argparse.ArgumentTypeError(
+                "Invalid period length. Valid values are 'month' or a "
+                "positive number of days.")
+        return days
+
     def parse_type(string):
         """
         Parse type of report. Defaults to ``manual``.
@@ -89,61 +115,326 @@ def parse_cmd():
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "-s", "--start-date", type=parse_date,
+        "-s", "--start-date", type=parse_date_arg,
         help="Period start date in YYYYmmdd format. If specified, --end-date "
              "needs to be specified as well. If not specified the previous "
              "month is picked as the testing period.")
     parser.add_argument(
-        "-e", "--end-date", type=parse_date,
+        "-e", "--end-date", type=parse_date_arg,
         help="Period end date in YYYYmmdd format. If specified, --start-date "
              "needs to be specified as well. If not specified the previous "
              "month is picked as the testing period.")
     parser.add_argument("-t", "--report-type",
         type=parse_type, required=False, default=ReportType.manual,
         help="Set the report type: {manual(default), auto}.")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="Number of processes used for parsing the RIPEstat responses "
+             "and calculating the metrics (default 1).")
+    parser.add_argument("--m3-engine",
+        choices=["python", "db", "db-validate"], default="python",
+        help="Calculate m3 in Python from the CIDR report files (default), "
+             "in the DB after loading the files in it, or in the DB "
+             "validated against the Python calculation.")
+    parser.add_argument("--state",
+        help="Incremental mode. Fold a single day (see --day) into the "
+             "state kept in the given file and write the provisional "
+             "results. The state covers the month of the first folded day.")
+    parser.add_argument("--day", type=parse_date_arg,
+        help="Day to fold in the incremental state in YYYYmmdd format. "
+             "Defaults to yesterday. A day that is already folded is folded "
+             "again, e.g. for late reported events.")
+    parser.add_argument("--finalise", action="store_true",
+        help="Create and store the report for the period of the incremental "
+             "state given with --state instead of folding a day.")
+    parser.add_argument("--backfill", type=parse_period_length,
+        metavar="LENGTH",
+        help="Backfill mode. Split the period given with --start-date and "
+             "--end-date in periods of the given length ('month' or a "
+             "number of days) and create and store a report for each of "
+             "them, fetching the data sources only once.")
     parser.add_argument("-v", "--verbosity",
         choices=["debug", "info", "warning", "error", "critical"],
         help="Set the logging level: {debug, info, warning(default), "
         "error, critical}")
 
     args = parser.parse_args()
-    define_period(args)
+    if args.backfill and (args.state or not (args.start_date
+                                              and args.end_date)):
+        raise argparse.ArgumentTypeError(
+            "--backfill needs --start-date and --end-date and cannot be "
+            "used with --state!")
+    if args.state:
+        if args.start_date or args.end_date:
+            raise argparse.ArgumentTypeError(
+                "The period of the incremental mode is defined by the "
+                "state!")
+        if args.m3_engine != "python":
+            raise argparse.ArgumentTypeError(
+                "The incremental mode calculates m3 in Python; --m3-engine "
+                "cannot be used with --state!")
+        if not args.day:
+            today = datetime.now()
+            args.day = datetime(
+                year=today.year, month=today.month,
+                day=today.day) - timedelta(days=1)
+    else:
+        if args.day or args.finalise:
+            raise argparse.ArgumentTypeError(
+                "--day and --finalise can only be used with --state!")
+        define_period(args)
     return args
 
 
-def configure_logging(verbosity):
+def check_db_connection():
+    """
+    Check that we have a connection to the database.
+    Throw early error if there is a connection problem (ie. postgres not
+    running/listening)
+
+    """
+    Session = sessionmaker(config.DB_ENGINE)
+    session = Session()
+    _ = session.query(Report).get(1)
+    session.close()
+
+
+def get_periods(start, end, length):
+    """
+    Split the [start, end) range in consecutive periods of the given length
+    ('month' or a number of days). The last period is cut at the end of the
+    range.
+
+    """
+    periods = []
+    period_start = start
+    while period_start < end:
+        if length == "month":
+            period_end = get_month(period_start)[1]
+        else:
+            period_end = period_start + timedelta(days=length)
+        period_end = min(period_end, end)
+        periods.append((period_start, period_end))
+        period_start = period_end
+    return periods
+
+
+def get_ripestat_results(asns, workers=1):
     """
-    Configure logging.
+    Get the results of the RIPEstat data source, using the response cache and
+    the checkpoint if configured.
 
-    Command line option for level has precedence.
-    Format and file are configured from the config file.
+    If local RPSL dumps are configured the imports/exports (m6) and contact
+    information (m8) results come from them. If local IRR route object dumps
+    and a routing table snapshot are configured the registered routes
+    (m7irr) results come from them. RIPEstat is only asked for the data
+    calls still needed.
 
     """
-    if not verbosity:
-        level = config.LOGGING_LEVEL
+    use_rpsl = bool(settings.RPSL_DUMP_FILES)
+    use_irr = bool(settings.IRR_ROUTE_DUMP_FILES
+                   and settings.RIB_SNAPSHOT_FILE)
+    data_calls = []
+    if not use_rpsl:
+        data_calls.append('whois')
+    if not (use_rpsl and use_irr):
+        data_calls.append('as_routing_consistency')
+
+    if data_calls:
+        cache = None
+        if settings.RIPESTAT_CACHE_FILE:
+            cache = RIPEstatCache(settings.RIPESTAT_CACHE_FILE)
+        checkpoint = None
+        if settings.RIPESTAT_CHECKPOINT_FILE:
+            checkpoint = RIPEstatCheckpoint(settings.RIPESTAT_CHECKPOINT_FILE)
+        ripestat = RIPEstatSourceData(asns, cache=cache, workers=workers,
+                                      data_calls=data_calls,
+                                      checkpoint=checkpoint)
+        ripestat.fetch_data()
+        results = ripestat.get_results()
     else:
-        level = getattr(logging, verbosity.upper())
+        results = {asn: {} for asn in asns}
+
+    local_sources = []
+    if use_rpsl:
+        local_sources.append(RPSLSourceData(settings.RPSL_DUMP_FILES, asns))
+    if use_irr:
+        local_sources.append(RPSLRoutingSourceData(
+            settings.IRR_ROUTE_DUMP_FILES, settings.RIB_SNAPSHOT_FILE, asns))
+    for source in local_sources:
+        source.fetch_data()
+        for asn, source_results in source.get_results().items():
+            results[asn].update(source_results)
+    return results
+
+
+def get_cidr_db_results(asns, period_start, period_end, validate=False,
+                        fetch=True):
+    """
+    Get the m3 results calculated in the DB. With 'validate' they are
+    compared with the Python calculation and any mismatch is an error.
+
+    """
+    cidr_db = CIDRDBSourceData(config.DB_ENGINE,
+                               settings.CIDR_DATA_DIRECTORY,
+                               period_start=period_start,
+                               period_end=period_end)
+    if fetch:
+        cidr_db.fetch_data()
+    results = cidr_db.get_precomputed_results(asns)
+    if validate:
+        mismatches = cidr_db.validate(asns, results)
+        if mismatches:
+            raise CIDRValidationError(
+                "m3 calculated in the DB differs from Python for {} "
+                "ASNs!".format(len(mismatches)))
+    return results
+
+
+def register_cidr_db_metric():
+    """
+    Calculate m3 from the results calculated in the DB.
+
+    """
+    register_metric(PrecomputedMetric(
+        'm3', 'cidr_db', ('bogon_prefixes', 'culprits'), default=0))
+
+
+def write_latest_report(report):
+    """
+    Write the report to disk if configured.
+
+    """
+    if config.LATEST_REPORT_FILE:
+        logging.info("Writing report to '{}'".format(
+           os.path.abspath(config.LATEST_REPORT_FILE)))
+        with open(config.LATEST_REPORT_FILE, 'w') as f:
+            json.dump(report, f, indent=4, default=str)
+
+
+def main_incremental(args):
+    """
+    Fold a single day in the incremental state or finalise the state's period
+    and save the report in the DB.
 
-    if config.LOGGING_FILE:
-        logging.basicConfig(level=level,
-                            format=config.LOGGING_FORMAT,
-                            filename=config.LOGGING_FILE)
+    """
+    if os.path.isfile(args.state):
+        state = IncrementalState.load(args.state)
+    elif args.finalise:
+        raise IncrementalStateError("No state found in '{}'!".format(
+            args.state))
     else:
-        logging.basicConfig(level=level,
-                            format=config.LOGGING_FORMAT)
+        state = IncrementalState(*get_month(args.day))
+
+    if args.finalise:
+        check_db_connection()
+        asns = get_asns()
+        ripestat_results = get_ripestat_results(asns, workers=args.workers)
+
+        logging.info("Finalising metrics")
+        report = {
+            'period_start': state.period_start,
+            'period_end': state.period_end,
+            'generated': datetime.now(),
+            'results': state.finalise(asns, ripestat_results),
+        }
+        write_latest_report(report)
+
+        logging.info("Storing report in DB")
+        store_report(report, args.report_type)
+        logging.info("Finished")
+        return
+
+    day_start = args.day
+    day_end = day_start + timedelta(days=1)
+    weight_generator_factory = WeightGeneratorFactory(
+        settings.WEIGHT_GENERATOR_TYPE, settings.WEIGHT_GENERATOR_START,
+        settings.WEIGHT_GENERATOR_INTERVAL, settings.WEIGHT_GENERATOR_END)
+    asns = get_asns()
+
+    bgp_stream = get_bgp_stream_source(day_start, day_end)
+    cidr = CIDRSourceData(settings.CIDR_DATA_DIRECTORY,
+                          period_start=day_start,
+                          period_end=day_end)
+    bgp_stream.fetch_data()
+    bgp_stream_results = bgp_stream.get_results(weight_generator_factory)
+    cidr.fetch_data()
+    cidr_results = cidr.get_results()
 
+    state.fold(day_start, day_end, asns, bgp_stream_results, cidr_results)
+    state.save(args.state)
 
-def check_db_connection():
+    report = {
+        'period_start': state.period_start,
+        'period_end': state.period_end,
+        'generated': datetime.now(),
+        'results': state.get_results(),
+    }
+    write_latest_report(report)
+    logging.info("Finished")
+
+
+def main_backfill(args):
     """
-    Check that we have a connection to the database.
-    Throw early error if there is a connection problem (ie. postgres not
-    running/listening)
+    Create and store the reports of all the periods of the backfill range.
+
+    Each data source is fetched once for the whole range and its results are
+    split per period.
 
     """
-    Session = sessionmaker(config.DB_ENGINE)
-    session = Session()
-    _ = session.query(Report).get(1)
-    session.close()
+    periods = get_periods(args.start_date, args.end_date, args.backfill)
+    logging.info("Backfilling {} periods".format(len(periods)))
+    weight_generator_factory = WeightGeneratorFactory(
+        settings.WEIGHT_GENERATOR_TYPE, settings.WEIGHT_GENERATOR_START,
+        settings.WEIGHT_GENERATOR_INTERVAL, settings.WEIGHT_GENERATOR_END)
+
+    check_db_connection()
+
+    asns = get_asns()
+
+    bgp_stream = get_bgp_stream_source(args.start_date, args.end_date)
+    bgp_stream.fetch_data()
+
+    ripestat_results = get_ripestat_results(asns, workers=args.workers)
+
+    if args.m3_engine == "python":
+        cidr = CIDRSourceData(settings.CIDR_DATA_DIRECTORY,
+                              period_start=args.start_date,
+                              period_end=args.end_date)
+        cidr.fetch_data()
+    else:
+        CIDRDBSourceData(config.DB_ENGINE, settings.CIDR_DATA_DIRECTORY,
+                         period_start=args.start_date,
+                         period_end=args.end_date).fetch_data()
+        register_cidr_db_metric()
+
+    report = None
+    for period_start, period_end in periods:
+        logging.info("Calculating metrics for {} - {}".format(
+            period_start.date(), period_end.date()))
+        bgp_stream_results = bgp_stream.get_results(
+            weight_generator_factory, period_start, period_end)
+        if args.m3_engine == "python":
+            cidr_results = cidr.get_results(period_start, period_end)
+            other_results = {}
+        else:
+            cidr_results = None
+            other_results = {'cidr_db': get_cidr_db_results(
+                asns, period_start, period_end,
+                validate=args.m3_engine == "db-validate", fetch=False)}
+        results = get_results_per_asn(asns, bgp_stream_results, cidr_results,
+                                      ripestat_results, workers=args.workers,
+                                      **other_results)
+        report = {
+            'period_start': period_start,
+            'period_end': period_end,
+            'generated': datetime.now(),
+            'results': results,
+        }
+        logging.info("Storing report in DB")
+        store_report(report, args.report_type)
+
+    write_latest_report(report)
+    logging.info("Finished")
 
 
 def main():
@@ -154,7 +445,15 @@ def main():
 
     """
     args = parse_cmd()
-    configure_logging(args.verbosity)
+    configure_logging(args.verbosity, config.LOGGING_LEVEL,
+                      config.LOGGING_FORMAT, config.LOGGING_FILE)
+    if args.state:
+        main_incremental(args)
+        return
+    if args.backfill:
+        main_backfill(args)
+        return
+
     period_start = args.start_date
     period_end = args.end_date
     weight_generator_factory = WeightGeneratorFactory(
@@ -164,18 +463,10 @@ def main():
 
     check_db_connection()
 
-    logging.info("Getting participants")
-    participants = get_manrs_participants()
-
-    asns = set()
-    for participant in participants:
-        for asn in participant['asns']:
-            asns.add(asn)
+    asns = get_asns()
 
     logging.info("Starting modules")
-    bgp_stream = BGPStreamSourceData(period_start=period_start,
-                                     period_end=period_end)
-    ripestat = RIPEstatSourceData(asns)
+    bgp_stream = get_bgp_stream_source(period_start, period_end)
     cidr = CIDRSourceData(cidr_data_dir,
                           period_start=period_start,
                           period_end=period_end)
@@ -184,15 +475,23 @@ def main():
     bgp_stream.fetch_data()
     bgp_stream_results = bgp_stream.get_results(weight_generator_factory)
 
-    ripestat.fetch_data()
-    ripestat_results = ripestat.get_results()
+    ripestat_results = get_ripestat_results(asns, workers=args.workers)
 
-    cidr.fetch_data()
-    cidr_results = cidr.get_results()
+    if args.m3_engine == "python":
+        cidr.fetch_data()
+        cidr_results = cidr.get_results()
+        other_results = {}
+    else:
+        cidr_results = None
+        other_results = {'cidr_db': get_cidr_db_results(
+            asns, period_start, period_end,
+            validate=args.m3_engine == "db-validate")}
+        register_cidr_db_metric()
 
     logging.info("Calculating metrics")
     results = get_results_per_asn(asns, bgp_stream_results, cidr_results,
-                                  ripestat_results)
+                                  ripestat_results, workers=args.workers,
+                                  **other_results)
 
     report = {
         'period_start': period_start,
@@ -201,11 +500,7 @@ def main():
         'results': results,
     }
 
-    if config.LATEST_REPORT_FILE:
-        logging.info("Writing report to '{}'".format(
-           os.path.abspath(config.LATEST_REPORT_FILE)))
-        with open(config.LATEST_REPORT_FILE, 'w') as f:
-            json.dump(report, f, indent=4, default=str)
+    write_latest_report(report)
 
     logging.info("Storing report in DB")
     store_report(report, args.report_type)
@@ -264,3 +559,4 @@ if __name__ == "__main__":
     except Exception as e:
         logging.critical("Execution failed!")
         logging.critical("{}: {}".format(e.__class__.__name__, e))
+        sys.exit(1)
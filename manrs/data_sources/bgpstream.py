@@ -1,11 +1,24 @@
 # Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from collections import OrderedDict
+import codecs
+from contextlib import closing
 from datetime import datetime, timedelta
+import gzip
+import io
 import logging
+import os
 import requests
 import json
+import sqlite3
+
+try:
+    import zstandard
+except ImportError:  # Only needed for zstd compressed archives
+    zstandard = None
+
+from manrs import settings
+from manrs.util import NULL_TIMESTAMP, TIMESTAMP_FORMAT, parse_timestamp
 
 
 class BGPStreamError(Exception):
@@ -32,6 +45,237 @@ class BGPStreamInputError(BGPStreamError):
     pass
 
 
+class _JSONStream(object):
+    """
+    Minimal incremental parser for a JSON object given in text chunks.
+
+    """
+    WHITESPACE = " \t\n\r"
+    DELIMITERS = WHITESPACE + ",]}:"
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _read(self):
+        """
+        Append the next chunk to the buffer, dropping the consumed part.
+
+        """
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        """
+        while True:
+            while (self._pos < len(self._buffer)
+                    and self._buffer[self._pos] in self.WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON data")
+
+    def _expect(self, characters):
+        """
+        Consume and return the next character which needs to be one of the
+        given characters.
+
+        """
+        character = self._peek()
+        if character not in characters:
+            raise ValueError("Expected one of '{}' but found '{}'".format(
+                characters, character))
+        self._pos += 1
+        return character
+
+    def _value(self):
+        """
+        Parse the next complete JSON value.
+
+        A value is only accepted when a delimiter follows it so that values
+        cut at the chunk's end (e.g. numbers like "-12" of "-12.25") are not
+        parsed prematurely.
+
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                if (end < len(self._buffer)
+                        and self._buffer[end] in self.DELIMITERS):
+                    self._pos = end
+                    return value
+            except ValueError:
+                pass
+            if not self._read():
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                self._pos = end
+                return value
+
+    def _elements(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def members(self, array_member):
+        """
+        Yield (key, value) for every member of the object. The value of the
+        `array_member` is a generator yielding its elements one at a time
+        which needs to be consumed before continuing with the next member.
+
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == array_member:
+                yield key, self._elements()
+            else:
+                yield key, self._value()
+            if self._expect(",}") == "}":
+                return
+
+
+class BGPStreamEventStore(object):
+    """
+    Local SQLite store of the raw BGPStream events (outages excluded) keyed
+    by their event id and indexed by their start and end times.
+
+    Ongoing events ('0000-00-00 00:00:00' end time) have no end time in the
+    store until they are synced again with their final end time.
+
+    The store can be used as a context manager closing its connection on
+    exit; it is reopened when entered again.
+
+    """
+    TIME_FORMAT = TIMESTAMP_FORMAT
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            event_id TEXT PRIMARY KEY,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            event TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_start_time ON events (start_time);
+        CREATE INDEX IF NOT EXISTS events_end_time ON events (end_time);
+        CREATE TABLE IF NOT EXISTS sync (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            covered_from TEXT NOT NULL,
+            last_sync TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = None
+        self.open()
+
+    def open(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.filename)
+            self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_sync(self):
+        """
+        Return the (covered_from, last_sync) datetimes of the store or None
+        if it was never synced.
+
+        """
+        row = self.connection.execute(
+            "SELECT covered_from, last_sync FROM sync").fetchone()
+        if not row:
+            return None
+        return tuple(parse_timestamp(x) for x in row)
+
+    def set_sync(self, covered_from, last_sync):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sync VALUES (1, ?, ?)",
+                (covered_from.strftime(self.TIME_FORMAT),
+                 last_sync.strftime(self.TIME_FORMAT)))
+
+    def get_oldest_open_start_time(self, started_from):
+        """
+        Return the start time of the oldest ongoing event that started at or
+        after 'started_from'.
+
+        """
+        row = self.connection.execute(
+            "SELECT MIN(start_time) FROM events "
+            "WHERE end_time IS NULL AND start_time >= ?",
+            (started_from.strftime(self.TIME_FORMAT),)).fetchone()
+        if not row[0]:
+            return None
+        return parse_timestamp(row[0])
+
+    def upsert(self, events):
+        """
+        Insert the raw events or replace them if already stored, e.g. when
+        their end time changed. Returns the number of events.
+
+        """
+        num = 0
+        with self.connection:
+            for event in events:
+                end_time = event['end_time']
+                if end_time == NULL_TIMESTAMP:
+                    end_time = None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)",
+                    (str(event['event_id']), event['start_time'], end_time,
+                     json.dumps(event)))
+                num += 1
+        return num
+
+    def get_events(self, period_start, period_end, started_from):
+        """
+        Return the raw events that may be active in the period and started
+        at or after 'started_from', as the live feed requested for the period
+        would.
+
+        """
+        rows = self.connection.execute(
+            "SELECT event FROM events "
+            "WHERE start_time >= ? AND start_time <= ? "
+            "AND (end_time IS NULL OR end_time >= ?) "
+            "ORDER BY start_time",
+            (started_from.strftime(self.TIME_FORMAT),
+             period_end.strftime(self.TIME_FORMAT),
+             period_start.strftime(self.TIME_FORMAT)))
+        return [json.loads(row[0]) for row in rows]
+
+
 class BGPStreamSourceData(object):
     API_URL = ("http://portal.bgpmon.net/bgpstream_server.php?"
                "action=get_events&days={days}")
@@ -88,7 +332,10 @@ class BGPStreamSourceData(object):
         },
     }
 
-    def __init__(self, period_start=None, period_end=None, leeway=30):
+    CHUNK_SIZE = 65536
+
+    def __init__(self, period_start=None, period_end=None, leeway=30,
+                 streaming=True, store=None):
         """
         Class to handle communication/parsing for the BGPStream data source.
 
@@ -97,6 +344,14 @@ class BGPStreamSourceData(object):
         started before the specified period but are still active in the
         given period.
 
+        With 'streaming' the events are parsed and filtered one at a time
+        while the response is downloaded instead of after loading the whole
+        response.
+
+        If a `BGPStreamEventStore` is given as 'store' only the events since
+        its last sync are downloaded and the period's events are read from
+        the store. The store is closed once they are read.
+
         """
         self.logger = logging.getLogger(__name__)
         self.logger.info("Starting module")
@@ -114,21 +369,25 @@ class BGPStreamSourceData(object):
         self.period_start = period_start
         self.period_end = period_end
         self.leeway = leeway
+        self.streaming = streaming
+        self.store = store
         self.data = None
+        self._good_signatures = set()
 
-    def _create_event(self, event, weight_generator):
+    def _create_event(self, event, weight_generator, period_start,
+                      period_end):
         # First check that the event is in the period.
-        if ((event['start_time'] < self.period_start
-                and event['end_time'] < self.period_start)
-                or (event['start_time'] > self.period_end
-                    and event['end_time'] > self.period_end)):
+        if ((event['start_time'] < period_start
+                and event['end_time'] < period_start)
+                or (event['start_time'] > period_end
+                    and event['end_time'] > period_end)):
             return None
 
         if event['event_type'] == "bgp_leak":
-            return LeakEvent(event, self.period_start, self.period_end,
+            return LeakEvent(event, period_start, period_end,
                              weight_generator)
         elif event['event_type'] == "bgp_hijack":
-            return HijackEvent(event, self.period_start, self.period_end,
+            return HijackEvent(event, period_start, period_end,
                                weight_generator)
 
     def _analyze_json_structure(self, data=None):
@@ -158,20 +417,13 @@ class BGPStreamSourceData(object):
             print("set:\n{}\n\n".format(sorted(list(s))))
         print("event_types: {}".format(event_types))
 
-    def _elaborate_data(self, original):
+    def _check_main_members(self, keys):
         """
-        Filter and sanitize data.
+        Check that the main members of the data are the expected ones.
 
         """
         main_members = set(self.API_JSON['main_members'])
-        event_types = set(self.API_JSON['event_types'])
-        event_members = self.API_JSON['event_members']
-
-        data = original.copy()
-        data['events'] = []
-
-        # Check main_members
-        for key in data:
+        for key in keys:
             try:
                 main_members.remove(key)
             except KeyError:
@@ -183,103 +435,586 @@ class BGPStreamSourceData(object):
                 "Main members have changed! {} are no longer part of the "
                 "specification.".format(main_members))
 
-        for event in original['events']:
-            # Check event_types
-            if event['event_type'] not in event_types:
-                raise BGPStreamInsaneDataError("New event type!")
+    def _check_event(self, event):
+        """
+        Check that the event's type and members are the expected ones.
+        Members of outage events are not checked.
 
-            # Filter out the outage type
-            if event['event_type'] == "outage":
-                continue
+        The key signatures that already passed are cached so that events
+        with a known signature are checked with a single lookup.
 
-            # Check event members
-            members = set(event_members[event['event_type']])
-            for key in event:
-                try:
-                    members.remove(key)
-                except KeyError:
-                    raise BGPStreamInsaneDataError(
-                        "New key in '{}' event type!".format(
-                         event['event_type']))
-
-            if members:
+        """
+        event_type = event['event_type']
+        try:
+            if (event_type, frozenset(event)) in self._good_signatures:
+                return
+        except TypeError:  # Unhashable event type
+            pass
+
+        # Check event_types
+        if event_type not in self.API_JSON['event_types']:
+            raise BGPStreamInsaneDataError("New event type!")
+
+        if event_type == "outage":
+            return
+
+        # Check event members
+        members = set(self.API_JSON['event_members'][event_type])
+        for key in event:
+            try:
+                members.remove(key)
+            except KeyError:
                 raise BGPStreamInsaneDataError(
-                    "Event members have changed for '{}' event type".format(
-                     event['event_type']))
+                    "New key in '{}' event type!".format(event_type))
 
-            time_format = "%Y-%m-%d %H:%M:%S"
-            start_time = datetime.strptime(event['start_time'], time_format)
-            try:
-                end_time = datetime.strptime(event['end_time'], time_format)
-            except ValueError:  # Parsing '0000-00-00 00:00:00'
-                end_time = self.period_end
+        if members:
+            raise BGPStreamInsaneDataError(
+                "Event members have changed for '{}' event type".format(
+                 event_type))
 
-            # Check if the event is within the period
-            if (start_time < self.period_start
-                    and (end_time and not end_time > self.period_start)):
-                continue
+        self._good_signatures.add((event_type, frozenset(event)))
 
-            event['start_time'] = start_time
-            event['end_time'] = end_time
-            data['events'].append(event)
+    def _elaborate_event(self, event):
+        """
+        Filter and sanitize a single event. Returns None if the event is
+        filtered out.
+
+        """
+        self._check_event(event)
+
+        # Filter out the outage type
+        if event['event_type'] == "outage":
+            return None
+
+        start_time = parse_timestamp(event['start_time'])
+        try:
+            end_time = parse_timestamp(event['end_time'])
+        except ValueError:
+            end_time = None
+        if end_time is None:  # Ongoing event ('0000-00-00 00:00:00')
+            end_time = self.period_end
+
+        # Check if the event is within the period
+        if (start_time < self.period_start
+                and (end_time and not end_time > self.period_start)):
+            return None
+        if start_time > self.period_end:
+            return None
+
+        event['start_time'] = start_time
+        event['end_time'] = end_time
+        return event
+
+    def _elaborate_data(self, original):
+        """
+        Filter and sanitize data.
+
+        """
+        data = original.copy()
+        data['events'] = []
+        self._check_main_members(data)
+
+        for event in original['events']:
+            event = self._elaborate_event(event)
+            if event:
+                data['events'].append(event)
 
         return data
 
+    def _elaborate_stream(self, chunks):
+        """
+        Filter and sanitize data while incrementally parsing them from the
+        given text chunks.
+
+        Each event is checked as soon as it is parsed. Only the events that
+        are kept are held in memory; outage events and events that ended
+        before or started after the period are dropped on the fly.
+
+        """
+        data = {}
+        for key, value in _JSONStream(chunks).members('events'):
+            if key != 'events':
+                data[key] = value
+                continue
+            data['events'] = []
+            for event in value:
+                event = self._elaborate_event(event)
+                if event:
+                    data['events'].append(event)
+        self._check_main_members(data)
+        return data
+
+    def _iter_raw_events(self, days):
+        """
+        Stream the checked raw events of the last days, without the outage
+        events.
+
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        keys = []
+        with closing(requests.get(self.API_URL.format(days=days),
+                                  stream=True)) as resp:
+            chunks = (decoder.decode(chunk)
+                      for chunk in resp.iter_content(self.CHUNK_SIZE))
+            for key, value in _JSONStream(chunks).members('events'):
+                keys.append(key)
+                if key != 'events':
+                    continue
+                for event in value:
+                    self._check_event(event)
+                    if event['event_type'] != "outage":
+                        yield event
+        self._check_main_members(keys)
+
+    def _get_wanted_from(self):
+        """
+        Return the oldest start time of the events requested for the period.
+
+        """
+        return self.period_start - timedelta(days=self.leeway)
+
+    def _sync_store(self):
+        """
+        Bring the event store up to date for the period.
+
+        Only the days since the last sync are requested, extended to also
+        cover every ongoing event that can be part of the period's events
+        (i.e. that started at most 'leeway' days before it) so that its end
+        time gets updated. If the store does not cover the period (plus
+        'leeway') yet, the whole period is requested.
+
+        """
+        now = datetime.now()
+        wanted_from = self._get_wanted_from()
+        sync = self.store.get_sync()
+        if sync is None or wanted_from < sync[0]:
+            fetch_from = wanted_from
+            covered_from = wanted_from
+        else:
+            covered_from, last_sync = sync
+            fetch_from = last_sync
+            oldest_open = self.store.get_oldest_open_start_time(wanted_from)
+            if oldest_open:
+                fetch_from = min(fetch_from, oldest_open)
+        days = (now - fetch_from).days + 1
+        self.logger.info("Syncing the event store for the last {} days"
+                         "".format(days))
+        num = self.store.upsert(self._iter_raw_events(days))
+        self.store.set_sync(covered_from, now)
+        self.logger.info("Synced {} events".format(num))
+
     def fetch_data(self):
         """
         Fetch the raw data after filtering and sanitization.
 
+        In streaming mode (default) the response is parsed incrementally while
+        it is being downloaded. If an event store is used it is synced first
+        and the period's events are read from it.
+
         """
         self.logger.info("Gathering raw data")
+        if self.store:
+            events = []
+            with self.store:
+                self._sync_store()
+                for event in self.store.get_events(self.period_start,
+                                                   self.period_end,
+                                                   self._get_wanted_from()):
+                    event = self._elaborate_event(event)
+                    if event:
+                        events.append(event)
+            self.data = {
+                'status': None,
+                'error': None,
+                'events': events,
+            }
+            return
+
         days = (datetime.now() - self.period_start).days
         days += self.leeway
-        resp = requests.get(self.API_URL.format(days=days))
-        data = self._elaborate_data(resp.json())
-        self.data = data
-
-    def get_results(self, weight_generator_factory):
+        url = self.API_URL.format(days=days)
+        if not self.streaming:
+            resp = requests.get(url)
+            self.data = self._elaborate_data(resp.json())
+            return
+
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with closing(requests.get(url, stream=True)) as resp:
+            chunks = (decoder.decode(chunk)
+                      for chunk in resp.iter_content(self.CHUNK_SIZE))
+            self.data = self._elaborate_stream(chunks)
+
+    def get_results(self, weight_generator_factory, period_start=None,
+                    period_end=None):
         """
         Get the results per check and per culprits and accomplices.
 
+        The metadata of each event are stored once as an `EventRecord` in
+        'events'. Culprits and accomplices are stored as
+        (event index, asn, weight) rows referencing them.
+
+        If a period within the fetched one is given, only its events are
+        used and they are clipped to it as if it was fetched on its own;
+        events that started more than 'leeway' days before it are dropped as
+        they would not have been fetched. This allows splitting a single
+        fetch in multiple periods.
+
         """
         self.logger.info("Getting results")
+        split = period_start is not None or period_end is not None
+        if period_start is None:
+            period_start = self.period_start
+        if period_end is None:
+            period_end = self.period_end
         results = {
             'bgp_leak': {
+                'events': [],
                 'culprits': [],
                 'accomplices': [],
             },
             'bgp_hijack': {
+                'events': [],
                 'culprits': [],
                 'accomplices': [],
             },
         }
+        wanted_from = period_start - timedelta(days=self.leeway)
         for event_dict in self.data['events']:
-            event = self._create_event(event_dict, weight_generator_factory)
+            # Apply the filtering of the fetch and of `_elaborate_event` for
+            # the period.
+            if split and (
+                    event_dict['start_time'] < wanted_from
+                    or event_dict['start_time'] > period_end
+                    or (event_dict['start_time'] < period_start
+                        and not event_dict['end_time'] > period_start)):
+                continue
+            event = self._create_event(event_dict, weight_generator_factory,
+                                       period_start, period_end)
             if not event:
                 continue
-            culprit = event.get_culprit()
-            accomplices = event.get_accomplices()
-            results[event.event_type]['culprits'].append(culprit)
-            results[event.event_type]['accomplices'].extend(accomplices)
+            event_results = results[event.event_type]
+            event_index = len(event_results['events'])
+            event_results['events'].append(event.get_record())
+            asn, weight = event.get_culprit()
+            event_results['culprits'].append((event_index, asn, weight))
+            for asn, weight in event.get_accomplices():
+                event_results['accomplices'].append(
+                    (event_index, asn, weight))
         self.logger.info("Done")
         return results
 
 
+_ASNS = {}
+
+
+def _intern_asn(token):
+    """
+    Convert an ASN token of an AS path to int, reusing the int of tokens
+    already seen.
+
+    """
+    try:
+        return _ASNS[token]
+    except KeyError:
+        asn = _ASNS[token] = int(token)
+        return asn
+
+
+def _get_path_hops(asns_in_path, culprit=None):
+    """
+    Return the (asn, hop distance) pairs of the accomplices along the AS path
+    in a single backwards walk over it.
+
+    The accomplices are the unique ASNs before the first occurrence of the
+    ASN the event reached (the one preceding the first occurrence of the
+    'culprit' if given, else the last one), nearest first. The hop distance
+    counts the unique ASNs before it. A culprit without a preceding ASN
+    reached nothing along the path.
+
+    """
+    hops = []
+    seen = set()
+    reached = None if culprit else asns_in_path[-1]
+    awaiting_reached = False
+    for token in reversed(asns_in_path):
+        if token == culprit:
+            # An earlier occurrence of the culprit; the reached ASN is the
+            # one preceding it.
+            awaiting_reached = True
+            reached = None
+        elif awaiting_reached:
+            awaiting_reached = False
+            reached = token
+        elif token != reached:
+            if reached is not None and token not in seen:
+                seen.add(token)
+                hops.append((_intern_asn(token), len(hops)))
+            continue
+        # The hops found so far lie past the first occurrence of the
+        # reached ASN.
+        hops = []
+        seen = set()
+    return hops
+
+
+class BGPStreamArchiveSourceData(BGPStreamSourceData):
+    """
+    Class to handle BGPStream events from local archives.
+
+    The archive is a directory with a file per day holding the events that
+    started that day in the live feed's schema, one JSON event per line
+    (NDJSON). Files are gzip ('YYYYmmdd.ndjson.gz') or zstd
+    ('YYYYmmdd.ndjson.zst') compressed; the latter needs the 'zstandard'
+    package.
+
+    """
+    DATE_FORMAT = "%Y%m%d"
+    EXTENSIONS = (".ndjson.gz", ".ndjson.zst")
+    OPEN_EVENTS_FILENAME = "open_events.json"
+
+    def __init__(self, archive_dir, period_start=None, period_end=None,
+                 leeway=30):
+        """
+        Only the files from 'leeway' days before the period up to the end of
+        the period are read.
+
+        """
+        super().__init__(period_start, period_end, leeway)
+        if not os.path.isdir(archive_dir):
+            raise BGPStreamInputError("Archive directory ({}) does not "
+                                      "exist!".format(archive_dir))
+        self.archive_dir = archive_dir
+
+    def _get_filename(self, date, extension=EXTENSIONS[0]):
+        return os.path.join(self.archive_dir,
+                            date.strftime(self.DATE_FORMAT) + extension)
+
+    def _get_files_in_period(self):
+        """
+        Get the archive files that may have events active in the period.
+
+        """
+        date = (self.period_start - timedelta(days=self.leeway)).date()
+        while date <= self.period_end.date():
+            for extension in self.EXTENSIONS:
+                filename = self._get_filename(date, extension)
+                if os.path.isfile(filename):
+                    yield filename
+                    break
+            else:
+                self.logger.debug("No archive file for {}".format(date))
+            date += timedelta(days=1)
+
+    @staticmethod
+    def _open(filename):
+        """
+        Open a compressed archive file for buffered reading of its lines.
+
+        """
+        if filename.endswith(".zst"):
+            if zstandard is None:
+                raise BGPStreamInputError(
+                    "The 'zstandard' package is needed for reading '{}'"
+                    "".format(filename))
+            raw = zstandard.ZstdDecompressor().stream_reader(
+                open(filename, 'rb'), closefd=True)
+            return io.TextIOWrapper(io.BufferedReader(raw), encoding='utf-8')
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(filename, 'rb')),
+                                encoding='utf-8')
+
+    def _iter_archived_events(self):
+        for filename in self._get_files_in_period():
+            self.logger.debug("Reading '{}'".format(filename))
+            with self._open(filename) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def fetch_data(self):
+        """
+        Read the archived events of the period after filtering and
+        sanitization.
+
+        """
+        self.logger.info("Reading archived data")
+        events = []
+        for event in self._iter_archived_events():
+            event = self._elaborate_event(event)
+            if event:
+                events.append(event)
+        self.data = {
+            'status': None,
+            'error': None,
+            'events': events,
+        }
+
+    def _load_open_events(self):
+        """
+        Return the {event id: start time} index of the archived events that
+        are still ongoing. Archives without an index are scanned once.
+
+        """
+        filename = os.path.join(self.archive_dir, self.OPEN_EVENTS_FILENAME)
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                return json.load(f)
+
+        self.logger.info("Indexing the ongoing archived events")
+        open_events = {}
+        for name in sorted(os.listdir(self.archive_dir)):
+            if not name.endswith(self.EXTENSIONS):
+                continue
+            with self._open(os.path.join(self.archive_dir, name)) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event['end_time'] == NULL_TIMESTAMP:
+                        open_events[str(event['event_id'])] = (
+                            event['start_time'])
+        return open_events
+
+    def _save_open_events(self, open_events):
+        filename = os.path.join(self.archive_dir, self.OPEN_EVENTS_FILENAME)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(open_events, f, sort_keys=True)
+        os.replace(tmp_filename, filename)
+
+    def update(self, days):
+        """
+        Download the events of the last days from the live feed and merge
+        them in the archive. Already archived events are replaced by their
+        latest version.
+
+        The download is extended to the oldest archived event that is still
+        ongoing (up to 'leeway' days before the given days) so that its end
+        time gets updated. The ongoing events are tracked in an index file in
+        the archive directory; older ones are dropped from it as they are
+        no longer refreshed.
+
+        """
+        now = datetime.now()
+        wanted_from = (now - timedelta(days=days + self.leeway)).strftime(
+            TIMESTAMP_FORMAT)
+        open_events = self._load_open_events()
+        stale = [event_id for event_id, start_time in open_events.items()
+                 if start_time < wanted_from]
+        if stale:
+            self.logger.info("No longer refreshing {} ongoing events started "
+                             "before {}".format(len(stale), wanted_from))
+            for event_id in stale:
+                del open_events[event_id]
+        if open_events:
+            oldest_open = parse_timestamp(min(open_events.values()))
+            days = max(days, (now - oldest_open).days + 1)
+        self.logger.info("Archiving the events of the last {} days"
+                         "".format(days))
+        events_per_date = {}
+        for event in self._iter_raw_events(days):
+            date = parse_timestamp(event['start_time']).date()
+            events_per_date.setdefault(date, {})[event['event_id']] = event
+
+        for date, events in sorted(events_per_date.items()):
+            filename = self._get_filename(date)
+            archived = {}
+            for extension in self.EXTENSIONS:
+                old_filename = self._get_filename(date, extension)
+                if not os.path.isfile(old_filename):
+                    continue
+                with self._open(old_filename) as f:
+                    for line in f:
+                        if line.strip():
+                            event = json.loads(line)
+                            archived[event['event_id']] = event
+            archived.update(events)
+            tmp_filename = filename + ".tmp"
+            with gzip.open(tmp_filename, 'wt', encoding='utf-8') as f:
+                for event in sorted(archived.values(),
+                                    key=lambda x: x['start_time']):
+                    f.write(json.dumps(event))
+                    f.write("\n")
+            os.replace(tmp_filename, filename)
+            for extension in self.EXTENSIONS[1:]:
+                old_filename = self._get_filename(date, extension)
+                if os.path.isfile(old_filename):
+                    os.remove(old_filename)
+            for event in archived.values():
+                if event['end_time'] == NULL_TIMESTAMP:
+                    open_events[str(event['event_id'])] = event['start_time']
+                else:
+                    open_events.pop(str(event['event_id']), None)
+            self.logger.info("Archived {} events in '{}'".format(
+                len(archived), filename))
+        self._save_open_events(open_events)
+
+
+class EventRecord(object):
+    """
+    Compact record of the event metadata shared by the event's culprit and
+    accomplices.
+
+    """
+    __slots__ = (
+        'prefix',
+        'start_time',
+        'end_time',
+        'duration',
+        'bgpstream_eventid',
+    )
+
+    def __init__(self, prefix, start_time, end_time, duration,
+                 bgpstream_eventid):
+        self.prefix = prefix
+        self.start_time = start_time
+        self.end_time = end_time
+        self.duration = duration
+        self.bgpstream_eventid = bgpstream_eventid
+
+    def as_dict(self, weight):
+        """
+        Return the data of a culprit/accomplice with the given weight.
+
+        """
+        return {
+            'prefix': self.prefix,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'weight': weight,
+            'duration': self.duration,
+            'bgpstream_eventid': self.bgpstream_eventid,
+        }
+
+
 class BGPEvent(object):
     """
     Abstract class for BGPStream events.
 
+    The members of the BGPStream event are accessible as attributes.
+
     """
+    __slots__ = (
+        '_event',
+        'curated_start_time',
+        'curated_end_time',
+        'duration',
+        'weights',
+    )
+
     def __init__(self, dictionary, period_start, period_end,
                  weight_generator_factory):
-        self._variables = []
-        for k, v in dictionary.items():
-            setattr(self, k, v)
-            self._variables.append(k)
-
+        self._event = dictionary
         self._curate_start_end_times(period_start, period_end)
         self._calculate_duration()
-        self.weight_generator = weight_generator_factory.get()
+        self.weights = weight_generator_factory.get_weights()
+
+    def __getattr__(self, name):
+        if name == '_event':
+            raise AttributeError(name)
+        try:
+            return self._event[name]
+        except KeyError:
+            raise AttributeError(name)
 
     def _curate_start_end_times(self, period_start, period_end):
         """
@@ -292,10 +1027,6 @@ class BGPEvent(object):
                                curated_start_time)
         self.curated_start_time = curated_start_time
         self.curated_end_time = curated_end_time
-        self._variables.extend([
-            'curated_start_time',
-            'curated_end_time',
-        ])
 
     def _calculate_duration(self):
         """
@@ -305,16 +1036,25 @@ class BGPEvent(object):
         duration = int((self.curated_end_time
                         - self.curated_start_time).total_seconds())
         self.duration = duration
-        self._variables.append('duration')
+
+    def get_record(self):
+        """
+        Get the event's metadata shared by the culprit and accomplices.
+
+        """
+        return EventRecord(self.prefix, self.curated_start_time,
+                           self.curated_end_time, self.duration,
+                           self.event_id)
 
     def __str__(self):
         """
         View the object's variables. Meant for debugging.
 
         """
-        res = {}
-        for variable in self._variables:
-            res[variable] = getattr(self, variable)
+        res = dict(self._event)
+        res['curated_start_time'] = self.curated_start_time
+        res['curated_end_time'] = self.curated_end_time
+        res['duration'] = self.duration
         return "{}".format(res)
 
     def __repr__(self):
@@ -326,24 +1066,22 @@ class LeakEvent(BGPEvent):
     Class for 'bgp_leak' BGPStream events.
 
     """
+    __slots__ = ()
+
+    @property
+    def prefix(self):
+        return self.leaked_prefix
+
     def get_culprit(self):
         """
-        Get the culprit of the leak.
+        Get the culprit of the leak as an (asn, weight) tuple.
 
         """
-        return {
-            'asn': int(self.leaker_asn),
-            'prefix': self.leaked_prefix,
-            'start_time': self.curated_start_time,
-            'end_time': self.curated_end_time,
-            'weight': 1.0,
-            'duration': self.duration,
-            'bgpstream_eventid': self.event_id,
-        }
+        return (int(self.leaker_asn), 1.0)
 
     def get_accomplices(self):
         """
-        Get all the accomplices.
+        Get all the accomplices as (asn, weight) tuples.
 
         Accomplices are ASNs that were reported as leaked_to from bgpstream.
         ASNs in the provided AS Path are also considered accomplices but the
@@ -353,41 +1091,20 @@ class LeakEvent(BGPEvent):
         """
         accomplices = []
 
-        if not ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE:
+        if not settings.ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE:
             # The last ASN in the path is the reporter, ignore it.
             asns_in_path = self.leak_as_path.split()[1:]
             # We ignore the leaked_to ASN for now; it is going to be included
             # further down.
-            leaker_index = asns_in_path.index(self.leaker_asn)
-            leaked_to = asns_in_path[leaker_index-1]
-            leaked_to_index = asns_in_path.index(leaked_to)
-            unique_ordered_asns = OrderedDict()
-            for asn in reversed(asns_in_path[:leaked_to_index]):
-                unique_ordered_asns[asn] = None
-            for asn in unique_ordered_asns:
-                accomplices.append({
-                    'asn': int(asn),
-                    'prefix': self.leaked_prefix,
-                    'start_time': self.curated_start_time,
-                    'end_time': self.curated_end_time,
-                    'weight': next(self.weight_generator),
-                    'duration': self.duration,
-                    'bgpstream_eventid': self.event_id,
-                })
+            for asn, distance in _get_path_hops(asns_in_path,
+                                                self.leaker_asn):
+                accomplices.append((asn, self.weights[distance]))
 
         # Add all the leaked_to ASNs. These get full weight.
         leaked_to = self.leaked_to.split(",")
         leaked_to = [x.split("=")[0] for x in leaked_to]
         for asn in leaked_to:
-            accomplices.append({
-                'asn': int(asn),
-                'prefix': self.leaked_prefix,
-                'start_time': self.curated_start_time,
-                'end_time': self.curated_end_time,
-                'weight': 1.0,
-                'duration': self.duration,
-                'bgpstream_eventid': self.event_id,
-            })
+            accomplices.append((int(asn), 1.0))
 
         return accomplices
 
@@ -397,24 +1114,22 @@ class HijackEvent(BGPEvent):
     Class for 'bgp_hijack' BGPStream events.
 
     """
+    __slots__ = ()
+
+    @property
+    def prefix(self):
+        return self.hijack_announced_prefix
+
     def get_culprit(self):
         """
-        Get the culprit of the leak.
+        Get the culprit of the hijack as an (asn, weight) tuple.
 
         """
-        return {
-            'asn': int(self.origin_asn),
-            'prefix': self.hijack_announced_prefix,
-            'start_time': self.curated_start_time,
-            'end_time': self.curated_end_time,
-            'weight': 1.0,
-            'duration': self.duration,
-            'bgpstream_eventid': self.event_id,
-        }
+        return (int(self.origin_asn), 1.0)
 
     def get_accomplices(self):
         """
-        Get all the accomplices.
+        Get all the accomplices as (asn, weight) tuples.
 
         All the ASNs in the reported AS Path except from the culprit and the
         reporter are considered accomplices. The weight for is significantly
@@ -429,30 +1144,27 @@ class HijackEvent(BGPEvent):
             return accomplices
 
         hijacked_to = asns_in_path[-1]
-        accomplices.append({
-            'asn': int(hijacked_to),
-            'prefix': self.hijack_announced_prefix,
-            'start_time': self.curated_start_time,
-            'end_time': self.curated_end_time,
-            'weight': 1.0,
-            'duration': self.duration,
-            'bgpstream_eventid': self.event_id,
-        })
-
-        if not ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE:
-            hijacked_to_index = asns_in_path.index(hijacked_to)
-            unique_ordered_asns = OrderedDict()
-            for asn in reversed(asns_in_path[:hijacked_to_index]):
-                unique_ordered_asns[asn] = None
-            for asn in unique_ordered_asns:
-                accomplices.append({
-                    'asn': int(asn),
-                    'prefix': self.hijack_announced_prefix,
-                    'start_time': self.curated_start_time,
-                    'end_time': self.curated_end_time,
-                    'weight': next(self.weight_generator),
-                    'duration': self.duration,
-                    'bgpstream_eventid': self.event_id,
-                })
+        accomplices.append((int(hijacked_to), 1.0))
+
+        if not settings.ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE:
+            for asn, distance in _get_path_hops(asns_in_path):
+                accomplices.append((asn, self.weights[distance]))
 
         return accomplices
+
+
+def get_bgp_stream_source(period_start, period_end):
+    """
+    Get the BGPStream data source for the period; the local archive or the
+    live feed, using the local event store if configured.
+
+    """
+    if settings.BGPSTREAM_ARCHIVE_DIRECTORY:
+        return BGPStreamArchiveSourceData(
+            settings.BGPSTREAM_ARCHIVE_DIRECTORY, period_start=period_start,
+            period_end=period_end)
+    store = None
+    if settings.BGPSTREAM_STORE_FILE:
+        store = BGPStreamEventStore(settings.BGPSTREAM_STORE_FILE)
+    return BGPStreamSourceData(period_start=period_start,
+                               period_end=period_end, store=store)
@@ -2,12 +2,19 @@
 # SPDX-License-Identifier: AGPL-3.0-only
 
 from collections import defaultdict
+import csv
 from datetime import datetime, timedelta
+import io
 import logging
 import os
 import sys
 
+from sqlalchemy import text
+
 from manrs import settings
+from manrs.metrics import (
+    _calculate_weighted_duration, _summarise_incidents, get_scoring_settings)
+from manrs.util import parse_date
 
 
 class CIDRError(Exception):
@@ -26,6 +33,15 @@ class CIDRInputError(CIDRError):
     pass
 
 
+class CIDRValidationError(CIDRError):
+    """
+    Error indicating that the results calculated in the DB differ from the
+    ones calculated in Python.
+
+    """
+    pass
+
+
 class CIDRSourceData(object):
     """
     Class to handle parsing of the daily saved data from CIDR.
@@ -108,12 +124,20 @@ class CIDRSourceData(object):
             data[date]['bogon_prefixes'] = self._parse_bogon_prefix(filename)
         self.data = data
 
-    def get_results(self):
+    def get_results(self, period_start=None, period_end=None):
         """
         Get the results per check and per culprit.
 
+        If a period within the fetched one is given, only the data of its
+        days are used.
+
         """
         self.logger.info("Getting results")
+        split = period_start is not None or period_end is not None
+        if period_start is None:
+            period_start = self.period_start
+        if period_end is None:
+            period_end = self.period_end
         results = {
             'bogon_prefixes': {
                 # A bit ugly but we will need
@@ -128,11 +152,14 @@ class CIDRSourceData(object):
             },
         }
         for date, checks in self.data.items():
+            # Every line of a day's file has the same date.
+            start_time = parse_date(date)
+            if split and not period_start <= start_time < period_end:
+                continue
+            end_time = start_time + timedelta(days=1)
             for check, data in checks.items():
                 for prefix, asn, description in data:
                     # results[check]['culprits'][asn][prefix]['dates'].add(date)
-                    start_time = datetime.strptime(date, "%Y%m%d")
-                    end_time = start_time + timedelta(days=1)
                     results[check]['culprits'][asn].append({
                         'prefix': prefix,
                         'start_time': start_time,
@@ -141,3 +168,217 @@ class CIDRSourceData(object):
                     })
         self.logger.info("Done")
         return results
+
+
+class CIDRDBSourceData(CIDRSourceData):
+    """
+    Class to handle the locally saved data from CIDR inside the DB.
+
+    The daily snapshots are bulk-loaded in the `bogon_prefixes` table and the
+    incidents (consecutive days with bogon advertisements per ASN) and their
+    scores are calculated with a gaps-and-islands query, without pulling the
+    daily events through Python.
+
+    """
+    INCIDENTS_QUERY = """
+        WITH days AS (
+            SELECT DISTINCT asn, date
+            FROM bogon_prefixes
+            WHERE date >= :period_start AND date < :period_end
+                AND asn = ANY(:asns)
+        ), islands AS (
+            SELECT asn, date,
+                date - CAST(ROW_NUMBER() OVER (
+                    PARTITION BY asn ORDER BY date) AS integer) AS island
+            FROM days
+        ), incidents AS (
+            SELECT asn, MIN(date) AS start_date, MAX(date) + 1 AS end_date,
+                CAST(COUNT(*) * 86400 AS numeric) AS duration
+            FROM islands
+            GROUP BY asn, island
+        ), scored AS (
+            SELECT asn, start_date, end_date, duration,
+                floor(duration / :tolerant_duration) AS intolerant_num,
+                mod(duration, :tolerant_duration) AS seconds
+            FROM incidents
+        )
+        SELECT s.asn, s.start_date, s.end_date,
+            CASE
+                WHEN s.intolerant_num > 0 AND :penalty = 'exponential'
+                    THEN power(2, s.intolerant_num)
+                WHEN s.intolerant_num > 0
+                    THEN s.intolerant_num + 1
+                WHEN s.seconds < :acceptable_duration
+                    THEN :acceptable_score
+                ELSE :tolerant_score
+            END AS score,
+            array_agg(DISTINCT b.prefix ORDER BY b.prefix) AS prefixes
+        FROM scored s
+        JOIN bogon_prefixes b ON b.asn = s.asn
+            AND b.date >= s.start_date AND b.date < s.end_date
+        GROUP BY s.asn, s.start_date, s.end_date, s.intolerant_num, s.seconds
+        ORDER BY s.asn, s.start_date
+    """
+    EVENTS_QUERY = """
+        SELECT asn, date, prefix
+        FROM bogon_prefixes
+        WHERE date >= :period_start AND date < :period_end
+            AND asn = ANY(:asns)
+        ORDER BY asn, date, id
+    """
+
+    def __init__(self, engine, data_dir, period_start=None, period_end=None):
+        super().__init__(data_dir, period_start, period_end)
+        self.engine = engine
+
+    def _get_loaded_dates(self, connection):
+        """
+        Get the dates of the period that are already loaded in the DB.
+
+        """
+        rows = connection.execute(
+            text("SELECT DISTINCT date FROM bogon_prefixes "
+                 "WHERE date >= :period_start AND date < :period_end"),
+            period_start=self.period_start.date(),
+            period_end=self.period_end)
+        return {row[0].strftime("%Y%m%d") for row in rows}
+
+    def fetch_data(self):
+        """
+        Bulk-load the locally stored data of the period that are not yet in
+        the DB.
+
+        """
+        self.logger.info("Loading data in the DB")
+        with self.engine.connect() as connection:
+            loaded_dates = self._get_loaded_dates(connection)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for date, filename in self._get_files_in_period():
+            if date in loaded_dates:
+                continue
+            for prefix, asn, description in self._parse_bogon_prefix(
+                    filename):
+                writer.writerow([date, prefix, asn, description])
+        buffer.seek(0)
+
+        raw_connection = self.engine.raw_connection()
+        try:
+            cursor = raw_connection.cursor()
+            cursor.copy_expert(
+                "COPY bogon_prefixes (date, prefix, asn, description) "
+                "FROM STDIN WITH (FORMAT csv)", buffer)
+            raw_connection.commit()
+        finally:
+            raw_connection.close()
+
+    def _get_events(self, connection, asns):
+        """
+        Get the daily events per ASN in the form `CIDRSourceData` gives
+        them, with their times serialised as they are stored.
+
+        """
+        events = {}
+        rows = connection.execute(
+            text(self.EVENTS_QUERY),
+            period_start=self.period_start.date(),
+            period_end=self.period_end,
+            asns=list(asns))
+        for asn, date, prefix in rows:
+            start_time = datetime(date.year, date.month, date.day)
+            events.setdefault(asn, []).append({
+                'prefix': prefix,
+                'start_time': start_time.isoformat(),
+                'end_time': (start_time + timedelta(days=1)).isoformat(),
+                'weight': 1.0,
+            })
+        return events
+
+    def get_precomputed_results(self, asns):
+        """
+        Get the results per check and per culprit.
+
+        The culprits are given per ASN as the metric's value and its data.
+        Following DURATION_DATA_STORAGE the data are either the daily events
+        or the incidents in the form `manrs.metrics._summarise_incidents`
+        returns them.
+
+        """
+        self.logger.info("Getting results")
+        scoring = get_scoring_settings()
+        if scoring['INCIDENT_INTOLERANT_PENALTY'] not in ("linear",
+                                                          "exponential"):
+            raise ValueError("Unknown value for INCIDENT_INTOLERANT_PENALTY: "
+                             "'{}'".format(
+                                 scoring['INCIDENT_INTOLERANT_PENALTY']))
+        results = {
+            'bogon_prefixes': {
+                'culprits': {},
+            },
+        }
+        culprits = results['bogon_prefixes']['culprits']
+        if not asns:
+            return results
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(self.INCIDENTS_QUERY),
+                period_start=self.period_start.date(),
+                period_end=self.period_end,
+                asns=list(asns),
+                tolerant_duration=scoring['INCIDENT_TOLERANT_DURATION'],
+                acceptable_duration=scoring['INCIDENT_ACCEPTABLE_DURATION'],
+                acceptable_score=scoring['INCIDENT_ACCEPTABLE_SCORE'],
+                tolerant_score=scoring['INCIDENT_TOLERANT_SCORE'],
+                penalty=scoring['INCIDENT_INTOLERANT_PENALTY'])
+            for asn, start_date, end_date, score, prefixes in rows:
+                culprit = culprits.setdefault(asn, {'value': 0, 'data': []})
+                culprit['value'] += float(score)
+                culprit['data'].append({
+                    'start_time': datetime(start_date.year, start_date.month,
+                                           start_date.day).isoformat(),
+                    'end_time': datetime(end_date.year, end_date.month,
+                                         end_date.day).isoformat(),
+                    'weight': 1.0,
+                    'prefixes': list(prefixes),
+                })
+            if settings.DURATION_DATA_STORAGE != "incidents":
+                events = self._get_events(connection, asns)
+                for asn, culprit in culprits.items():
+                    culprit['data'] = events[asn]
+        self.logger.info("Done")
+        return results
+
+    def validate(self, asns, results):
+        """
+        Compare the results with the ones calculated in Python from the
+        locally stored data and return the ASNs with different values or
+        data.
+
+        """
+        self.logger.info("Validating results")
+        python_source = CIDRSourceData(self.data_dir, self.period_start,
+                                       self.period_end)
+        python_source.fetch_data()
+        python_culprits = python_source.get_results()['bogon_prefixes'][
+            'culprits']
+        culprits = results['bogon_prefixes']['culprits']
+        mismatches = []
+        for asn in asns:
+            events = python_culprits.get(asn, [])
+            if settings.DURATION_DATA_STORAGE == "incidents":
+                expected_data = _summarise_incidents(events)
+            else:
+                expected_data = events
+            expected = _calculate_weighted_duration(events)
+            culprit = culprits.get(asn, {'value': 0, 'data': []})
+            if abs(expected - culprit['value']) > 1e-9:
+                self.logger.warning(
+                    "m3 mismatch for AS{}: {} (DB) != {} (Python)".format(
+                        asn, culprit['value'], expected))
+                mismatches.append(asn)
+            elif culprit['data'] != expected_data:
+                self.logger.warning(
+                    "m3 data mismatch for AS{}".format(asn))
+                mismatches.append(asn)
+        return mismatches
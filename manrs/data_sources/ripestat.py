@@ -1,16 +1,24 @@
 # Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime, timedelta
 import ipaddress
 import logging
 import json
+import os
+import random
+import sqlite3
+import time
 from timeit import default_timer
+import zlib
 
 import aiohttp
 import asyncio
 import requests
 
+from manrs import settings
+from manrs.radix import PrefixIndex
 from manrs.util import tries
 
 
@@ -30,8 +38,283 @@ class RIPEstatChangedVersionError(RIPEstatError):
     pass
 
 
+class RIPEstatIncompleteDataError(RIPEstatError):
+    """
+    Error indicating that too many data call requests failed.
+
+    """
+    pass
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the concurrent requests with an AIMD (additive increase,
+    multiplicative decrease) controller and their rate with a token bucket.
+
+    The concurrency limit grows by one request per limit's worth of
+    successful requests while it is fully used. It is halved on errors and
+    reduced by `LATENCY_DECREASE` when the recent latency of a kind of
+    request (e.g. a data call) exceeds `latency_tolerance` times its long
+    term latency, at most once per that latency so that a burst of failures
+    of requests already in flight counts as one. Both latencies are
+    exponentially weighted moving averages, with `SHORT_WEIGHT` and
+    `LONG_WEIGHT` for the newest latency, so that neither the normal spread
+    of a data call's latency nor kinds of requests answering in very
+    different times reduce the concurrency.
+
+    """
+    ERROR_DECREASE = 0.5
+    LATENCY_DECREASE = 0.9
+    SHORT_WEIGHT = 0.2
+    LONG_WEIGHT = 0.02
+
+    def __init__(self, initial, minimum, maximum, rate=0, burst=None,
+                 latency_tolerance=2.0):
+        """
+        'rate' is the number of requests per second allowed, with up to
+        'burst' (default: 'rate') requests at once. A rate of 0 disables
+        the token bucket.
+
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.latencies = {}
+        self.tokens = self.burst
+        self._last_refill = default_timer()
+        self._last_decrease = 0
+        self._condition = None
+
+    async def _take_token(self):
+        while self.rate:
+            now = default_timer()
+            refill = (now - self._last_refill) * self.rate
+            self.tokens = min(self.burst, self.tokens + refill)
+            self._last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        await self._take_token()
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, error, kind=None):
+        """
+        Release a request of the given kind and adapt the limit to its
+        outcome.
+
+        """
+        self.in_flight -= 1
+        self._adapt(latency, error, kind)
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _adapt(self, latency, error, kind=None):
+        congested = False
+        base_latency = None
+        if not error:
+            short, base_latency = self.latencies.get(kind, (latency, latency))
+            short += self.SHORT_WEIGHT * (latency - short)
+            base_latency += self.LONG_WEIGHT * (latency - base_latency)
+            self.latencies[kind] = (short, base_latency)
+            congested = short > self.latency_tolerance * base_latency
+        if error or congested:
+            now = default_timer()
+            if now - self._last_decrease < (base_latency or latency):
+                return
+            self._last_decrease = now
+            factor = self.ERROR_DECREASE if error else self.LATENCY_DECREASE
+            self.limit = max(self.minimum, self.limit * factor)
+        elif self.in_flight + 1 >= int(self.limit):
+            # Only grow while the limit is what holds the requests back.
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class RIPEstatCache(object):
+    """
+    Persistent on-disk cache of the RIPEstat responses in a SQLite file.
+
+    Responses are keyed by (data call, version, asn) and stored as zlib
+    compressed JSON together with the time they were fetched and their ETag
+    and Last-Modified headers for revalidation.
+
+    Writes are buffered and committed in a single transaction per
+    `BATCH_SIZE` writes or on `flush`.
+
+    """
+    BATCH_SIZE = 1000
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            data_call TEXT NOT NULL,
+            version TEXT NOT NULL,
+            asn INTEGER NOT NULL,
+            fetched_on REAL NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB NOT NULL,
+            PRIMARY KEY (data_call, version, asn)
+        );
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(self.SCHEMA)
+        self._puts = []
+        self._touches = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def flush(self):
+        """
+        Commit the buffered writes.
+
+        """
+        if not (self._puts or self._touches):
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses VALUES "
+                "(?, ?, ?, ?, ?, ?, ?)", self._puts)
+            self.connection.executemany(
+                "UPDATE responses SET fetched_on = ? "
+                "WHERE data_call = ? AND version = ? AND asn = ?",
+                self._touches)
+        self._puts = []
+        self._touches = []
+
+    def _buffered(self):
+        if len(self._puts) + len(self._touches) >= self.BATCH_SIZE:
+            self.flush()
+
+    def get(self, data_call, version, asn):
+        """
+        Return the cached response as a dictionary with its 'data', 'age' in
+        seconds, 'fetched_on' date, 'etag' and 'last_modified' or None if it
+        is not cached. Buffered writes are not seen.
+
+        """
+        row = self.connection.execute(
+            "SELECT fetched_on, etag, last_modified, body FROM responses "
+            "WHERE data_call = ? AND version = ? AND asn = ?",
+            (data_call, version, asn)).fetchone()
+        if not row:
+            return None
+        fetched_on, etag, last_modified, body = row
+        return {
+            'data': json.loads(zlib.decompress(body).decode('utf-8')),
+            'age': time.time() - fetched_on,
+            'fetched_on': date.fromtimestamp(fetched_on),
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    def put(self, data_call, version, asn, data, etag=None,
+            last_modified=None):
+        body = zlib.compress(json.dumps(data).encode('utf-8'))
+        self._puts.append((data_call, version, asn, time.time(), etag,
+                           last_modified, body))
+        self._buffered()
+
+    def touch(self, data_call, version, asn):
+        """
+        Mark a cached response as fresh after a successful revalidation.
+
+        """
+        self._touches.append((time.time(), data_call, version, asn))
+        self._buffered()
+
+
+class RIPEstatCheckpoint(object):
+    """
+    Checkpoint of the parsed results of a crawl in a JSON lines file, one
+    (asn, data call, result) per line, so that a failed run can be resumed
+    without fetching the completed data calls again.
+
+    Results are taken from the checkpoint while they are younger than the
+    data call's TTL (RIPESTAT_CACHE_TTL).
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def load(self, asns, data_calls):
+        """
+        Return the {asn: {data_call: result}} dictionary of the checkpointed
+        results of the given ASNs and data calls.
+
+        """
+        data = {}
+        if not os.path.isfile(self.filename):
+            return data
+        asns = set(asns)
+        today = date.today()
+        with open(self.filename, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # Incomplete line of an interrupted run
+                    continue
+                asn = entry['asn']
+                data_call = entry['data_call']
+                if asn not in asns or data_call not in data_calls:
+                    continue
+                result = entry['result']
+                checked_on = datetime.strptime(
+                    _get_checked_on(result), "%Y-%m-%d").date()
+                age = (today - checked_on).total_seconds()
+                if age < settings.RIPESTAT_CACHE_TTL[data_call]:
+                    data.setdefault(asn, {})[data_call] = result
+        return data
+
+    def add(self, asn, data_call, result):
+        if self._file is None:
+            self._file = open(self.filename, 'a')
+        self._file.write(json.dumps({
+            'asn': asn,
+            'data_call': data_call,
+            'result': result,
+        }))
+        self._file.write("\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        Remove the checkpoint after a complete run.
+
+        """
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+
 class RIPEstatSourceData(object):
     CONCURRENCY_LIMIT = 8
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+    RETRIES = 5
+    RETRY_BASE_DELAY = 1
+    RETRY_MAX_DELAY = 60
+    PARSE_QUEUE_SIZE = 2  # Responses waiting per parse worker
     DATA_CALLS = {
         'as_routing_consistency': {
             'url': (
@@ -43,6 +326,7 @@ class RIPEstatSourceData(object):
                 "https://stat.ripe.net/data/as-routing-consistency/meta/"
                 "versions/"),
             'version': "1.2",
+            'parser': "_get_as_routing_consistency_result",
         },
         'whois': {
             'url': (
@@ -52,10 +336,12 @@ class RIPEstatSourceData(object):
                 "&resource=AS{asn}"),
             'versions_url': "https://stat.ripe.net/data/whois/meta/versions/",
             'version': "4.1",
+            'parser': "_get_whois_result",
         },
     }
 
-    def __init__(self, asns):
+    def __init__(self, asns, cache=None, workers=1, data_calls=None,
+                 checkpoint=None):
         """
         Class to handle communication/parsing for the RIPEstat data source.
 
@@ -67,91 +353,232 @@ class RIPEstatSourceData(object):
         logged. If the known version is no longer part of the API a
         `RIPEstatChangedVersionError` will be raised.
 
+        If a `RIPEstatCache` is given as 'cache' the responses younger than
+        the data call's TTL (RIPESTAT_CACHE_TTL) are taken from it. Older
+        responses are revalidated when the server gave an ETag or
+        Last-Modified header for them.
+
+        Responses are parsed while the rest are being fetched and only the
+        parsed results are kept. With more than one 'workers' they are
+        parsed in a process pool.
+
+        'data_calls' limits the data calls used to the given ones; all of
+        `DATA_CALLS` by default.
+
+        If a `RIPEstatCheckpoint` is given as 'checkpoint' every successfully
+        fetched result is added to it and the results already in it are not
+        fetched again. It is removed once all the data are gathered.
+
         """
         self.logger = logging.getLogger(__name__)
         self.logger.info("Starting module")
         self.asns = asns
         self.checked_on = date.today().isoformat()
+        self.cache = cache
+        self.workers = workers
+        if data_calls is None:
+            data_calls = list(self.DATA_CALLS)
+        self.data_calls = data_calls
+        self.checkpoint = checkpoint
+        self.limiter = AdaptiveLimiter(
+            self.CONCURRENCY_LIMIT, settings.RIPESTAT_MIN_CONCURRENCY,
+            settings.RIPESTAT_MAX_CONCURRENCY,
+            rate=settings.RIPESTAT_REQUESTS_PER_SECOND)
+        self.failures = {}
         self.data = None
 
-    async def _fetch_url(self, semaphore, session, url, asn):
+    def _get_retry_delay(self, attempt, retry_after=None):
         """
-        Fetch the data. In case we didn't get a successful answer (HTTP 200)
-        retry before answering with None.
+        Exponential backoff with full jitter for the given (0 based) attempt.
+        A numeric Retry-After header of the server takes precedence.
+
+        """
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.RETRY_MAX_DELAY)
+        return random.uniform(0, min(self.RETRY_MAX_DELAY,
+                                     self.RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def _fetch_url(self, session, url, asn, data_call):
+        """
+        Fetch the data and return them as (asn, data_call, data, checked_on),
+        where 'checked_on' is the date they were fetched on. In case we
+        didn't get a successful answer (HTTP 200) because of a server error
+        (HTTP 5xx), throttling (HTTP 429), a connection error or an invalid
+        JSON body, retry with exponential backoff before answering with None.
+        Failed requests are recorded in `failures`.
+
+        The cache, if any, is consulted first and updated with the fetched
+        data. Each request goes through the adaptive limiter; server errors
+        (HTTP 5xx and 429) and slow responses reduce the concurrency.
 
         .. note:: Even with the retry data calls which need to return a lot of
         data may still return an HTTP 500 error from ripestat due to the
         servers' overreaching their capacity.
 
         """
-        async with semaphore:
-            for _ in tries(3, self.logger, "_fetch_url"):
-                async with session.get(url) as response:
+        version = self.DATA_CALLS[data_call]['version']
+        cached = None
+        headers = {}
+        if self.cache:
+            cached = self.cache.get(data_call, version, asn)
+        if cached:
+            if cached['age'] < settings.RIPESTAT_CACHE_TTL[data_call]:
+                return (asn, data_call, cached['data'],
+                        cached['fetched_on'].isoformat())
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        for tries_left in tries(self.RETRIES, self.logger, "_fetch_url"):
+            await self.limiter.acquire()
+            start = default_timer()
+            error = True
+            retry_after = None
+            try:
+                async with session.get(url, headers=headers) as response:
+                    error = (response.status >= 500
+                             or response.status == 429)
+                    if response.status == 304 and cached:
+                        self.cache.touch(data_call, version, asn)
+                        return (asn, data_call, cached['data'],
+                                self.checked_on)
                     if response.status == 200:
                         res = await response.json()
-                        return (asn, res)
-
-            self.logger.warning("{} error for '{}'"
-                                "".format(response.status, url))
-            return (asn, None)
-
-    async def _async_resolve(self, queries, data, data_call):
+                        if self.cache:
+                            self.cache.put(
+                                data_call, version, asn, res,
+                                etag=response.headers.get('ETag'),
+                                last_modified=response.headers.get(
+                                    'Last-Modified'))
+                        return (asn, data_call, res, self.checked_on)
+                    reason = "HTTP {}".format(response.status)
+                    if not error:
+                        # Client errors will not go away by retrying.
+                        break
+                    retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    ValueError) as e:  # ValueError: invalid JSON body
+                reason = "{}: {}".format(e.__class__.__name__, e)
+            finally:
+                await self.limiter.release(
+                    default_timer() - start, error, data_call)
+            if tries_left > 1:
+                await asyncio.sleep(self._get_retry_delay(
+                    self.RETRIES - tries_left, retry_after))
+
+        self.logger.warning("{} for '{}'".format(reason, url))
+        self.failures[(asn, data_call)] = reason
+        return (asn, data_call, None, self.checked_on)
+
+    async def _fetch_queries(self, session, pending, queue):
         """
-        Resolve the queries and update the data dictionary with the results.
-
-        Uses a BoundedSemaphore to limit the number of concurrent connections
-        to the ripestat servers.
-
-        As a precaution in case the session in invalidaded by the ripestat
-        servers it will try again.
+        Fetch the (asn, data_call, url) queries of the pending queue one at
+        a time and put the (asn, data_call, response, checked_on) items in
+        the parse queue.
 
         """
-        exception = None
-        for _ in tries(3, self.logger, "_async_resolve"):
+        while True:
             try:
-                semaphore = asyncio.BoundedSemaphore(self.CONCURRENCY_LIMIT)
-                async with aiohttp.ClientSession() as session:
-                    futures = [self._fetch_url(semaphore, session, url, asn)
-                               for asn, url in queries]
-                    for i, future in enumerate(asyncio.as_completed(futures)):
-                        asn, res = await future
-                        data[asn][data_call] = res
-                exception = None
-                break
-            except aiohttp.ClientError as e:
-                exception = e
-        if exception:
-            raise exception
+                asn, data_call, url = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await queue.put(
+                await self._fetch_url(session, url, asn, data_call))
 
-    def _update_data(self, data_call, data):
+    async def _parse_responses(self, queue, data, executor, errors):
         """
-        Build the needed queries and an async loop to fetch the data
-        asynchronously usign the data_call.
+        Parse the (asn, data_call, response, checked_on) items of the queue,
+        in the executor if any, and update the data dictionary with the
+        results.
 
         """
-        api_url = self.DATA_CALLS[data_call]['url']
-        api_version = self.DATA_CALLS[data_call]['version']
-        queries = [(asn, api_url.format(asn=asn, version=api_version))
-                   for asn in self.asns]
-
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self._async_resolve(queries, data,
-                                                    data_call))
-
-    def _update_as_routing_consistency_data(self, data):
+        while True:
+            asn, data_call, res, checked_on = await queue.get()
+            try:
+                if executor:
+                    result = await loop.run_in_executor(
+                        executor, _parse_response, data_call, asn, res,
+                        checked_on)
+                else:
+                    result = _parse_response(data_call, asn, res, checked_on)
+                data[asn][data_call] = result
+                if self.checkpoint and res is not None:
+                    self.checkpoint.add(asn, data_call, result)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                queue.task_done()
+
+    async def _async_resolve(self, queries, data, executor=None):
         """
-        Update the data dictionary with data from the as_routing_consinstency
-        data call.
+        Resolve the (asn, data_call, url) queries and update the data
+        dictionary with the parsed results.
 
-        """
-        self._update_data('as_routing_consistency', data)
+        All the queries share a single session whose connection pool keeps
+        the connections alive and caches the DNS resolution. Uses an
+        `AdaptiveLimiter` to limit the number of concurrent connections and
+        the rate of requests to the ripestat servers.
+
+        A fixed pool of fetch workers takes the queries one at a time and
+        hands each response to the parsers through a bounded queue. Fetching
+        waits for the parsers when the queue is full, so that at most a
+        response per fetch worker and the queued ones are held in memory at
+        any time, including the ones taken from the cache.
 
-    def _update_whois_data(self, data):
+        Queries that already have results in the data dictionary (e.g. from
+        a checkpoint) are skipped.
+
+        """
+        queue = asyncio.Queue(maxsize=self.PARSE_QUEUE_SIZE * self.workers)
+        pending = asyncio.Queue()
+        for asn, data_call, url in queries:
+            if data_call not in data[asn]:
+                pending.put_nowait((asn, data_call, url))
+        errors = []
+        parsers = [
+            asyncio.ensure_future(
+                self._parse_responses(queue, data, executor, errors))
+            for _ in range(self.workers)]
+        try:
+            connector = aiohttp.TCPConnector(
+                limit=settings.RIPESTAT_MAX_CONCURRENCY,
+                limit_per_host=settings.RIPESTAT_MAX_CONCURRENCY,
+                ttl_dns_cache=self.DNS_CACHE_TTL,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                await asyncio.gather(*[
+                    self._fetch_queries(session, pending, queue)
+                    for _ in range(settings.RIPESTAT_MAX_CONCURRENCY)])
+            await queue.join()
+        finally:
+            for parser in parsers:
+                parser.cancel()
+        if errors:
+            raise errors[0]
+
+    def _update_data(self, data):
         """
-        Update the data dictionary with data from the whois data call.
+        Build the queries of all the data calls, interleaved per ASN, and an
+        async loop to fetch and parse the data asynchronously.
 
         """
-        self._update_data('whois', data)
+        queries = []
+        for asn in self.asns:
+            for data_call in self.data_calls:
+                definition = self.DATA_CALLS[data_call]
+                url = definition['url'].format(
+                    asn=asn, version=definition['version'])
+                queries.append((asn, data_call, url))
+
+        loop = asyncio.get_event_loop()
+        if self.workers > 1:
+            with ProcessPoolExecutor(self.workers) as executor:
+                loop.run_until_complete(
+                    self._async_resolve(queries, data, executor))
+        else:
+            loop.run_until_complete(self._async_resolve(queries, data))
 
     def _check_data_call_version(self):
         """
@@ -159,7 +586,8 @@ class RIPEstatSourceData(object):
         by ripestat.
 
         """
-        for name, data_call in self.DATA_CALLS.items():
+        for name in self.data_calls:
+            data_call = self.DATA_CALLS[name]
             supported_version = data_call['version']
             versions_url = data_call['versions_url']
             meta = requests.get(versions_url).json()
@@ -182,7 +610,8 @@ class RIPEstatSourceData(object):
 
     def fetch_data(self):
         """
-        Fetch all the required data.
+        Fetch all the required data and parse them into results per ASN and
+        data call.
 
         """
         self.logger.info("Gathering and parsing data")
@@ -190,11 +619,49 @@ class RIPEstatSourceData(object):
         data = {}
         for asn in self.asns:
             data[asn] = {}
-        self._update_as_routing_consistency_data(data)
-        self._update_whois_data(data)
+        if self.checkpoint:
+            checkpointed = self.checkpoint.load(self.asns, self.data_calls)
+            for asn, results in checkpointed.items():
+                data[asn].update(results)
+            if checkpointed:
+                self.logger.info("Resuming with the results of {} ASNs from "
+                                 "the checkpoint".format(len(checkpointed)))
+        self.failures = {}
+        try:
+            self._update_data(data)
+        finally:
+            if self.cache:
+                self.cache.flush()
+            if self.checkpoint:
+                self.checkpoint.close()
         self.data = data
+        self._report_failures()
+        if self.checkpoint:
+            self.checkpoint.remove()
 
-    def _get_whois_result(self, asn, data):
+    def _report_failures(self):
+        """
+        Log the requests that failed and raise `RIPEstatIncompleteDataError`
+        if they are more than RIPESTAT_MAX_FAILURE_RATIO of all the requests.
+
+        """
+        if not self.failures:
+            return
+        failures_per_call = {}
+        for (asn, data_call), reason in sorted(self.failures.items()):
+            failures_per_call.setdefault(data_call, []).append(
+                "AS{} ({})".format(asn, reason))
+        for data_call, failures in failures_per_call.items():
+            self.logger.error("'{}' failed for {} ASNs: {}".format(
+                data_call, len(failures), ", ".join(failures)))
+        ratio = len(self.failures) / (len(self.asns) * len(self.data_calls))
+        if ratio > settings.RIPESTAT_MAX_FAILURE_RATIO:
+            raise RIPEstatIncompleteDataError(
+                "{} of the requests failed ({:.1%})!".format(
+                    len(self.failures), ratio))
+
+    @staticmethod
+    def _get_whois_result(asn, data, checked_on):
         """
         Check the whois data and return if the ASN has contact information
         properly registered.
@@ -202,7 +669,7 @@ class RIPEstatSourceData(object):
         """
         result = {
             'has_contact_info': None,
-            'checked_on': self.checked_on,
+            'checked_on': checked_on,
         }
         if not data:
             return result
@@ -251,7 +718,8 @@ class RIPEstatSourceData(object):
         result['has_contact_info'] = not no_contact
         return result
 
-    def _get_as_routing_consistency_result(self, asn, data):
+    @staticmethod
+    def _get_as_routing_consistency_result(asn, data, checked_on):
         """
         Check the as_routing_consistency data and return if the ASN has
         registered imports and exports and the status of the registered routes.
@@ -261,13 +729,13 @@ class RIPEstatSourceData(object):
             'imports_exports': {
                 'has_imports': None,
                 'has_exports': None,
-                'checked_on': self.checked_on
+                'checked_on': checked_on
             },
             'unregistered_routes': {
                 'total_routes_num': None,
                 'unregistered_routes_num': None,
                 'unregistered_routes': None,
-                'checked_on': self.checked_on
+                'checked_on': checked_on
             },
         }
         if not data:
@@ -301,20 +769,13 @@ class RIPEstatSourceData(object):
         # Check if the unregistered is just a more specific advertisement
         # of a registered prefix.
         unregistered_routes = []
-        registered_networks = []
+        registered_networks = PrefixIndex()
         if unregistered:
-            registered_networks = [ipaddress.ip_network(x) for x in registered]
+            registered_networks = PrefixIndex(
+                ipaddress.ip_network(x) for x in registered)
         for prefix in unregistered:
-            is_more_specific = False
             ip_network = ipaddress.ip_network(prefix)
-            for other_network in registered_networks:
-                if ip_network.version != other_network.version:
-                    continue
-                if (other_network.overlaps(ip_network)
-                        and not ip_network == other_network):
-                    is_more_specific = True
-                    break
-            if not is_more_specific:
+            if not registered_networks.overlaps_other(ip_network):
                 unregistered_routes.append(prefix)
         result['unregistered_routes']['unregistered_routes'] = (
             unregistered_routes)
@@ -327,21 +788,39 @@ class RIPEstatSourceData(object):
 
     def get_results(self):
         """
-        Parse the data and return results per ASN.
+        Return the parsed results per ASN.
 
         """
         self.logger.info("Getting results")
         results = {}
         for asn in self.asns:
             results[asn] = {}
-            whois_data = self.data[asn]['whois']
-            routing_data = self.data[asn]['as_routing_consistency']
-            whois_result = self._get_whois_result(asn, whois_data)
-            routing_result = self._get_as_routing_consistency_result(
-                asn, routing_data)
-
-            results[asn]['contact_info'] = whois_result
-            for check in routing_result:
-                results[asn][check] = routing_result[check]
+            if 'whois' in self.data_calls:
+                results[asn]['contact_info'] = self.data[asn]['whois']
+            if 'as_routing_consistency' in self.data_calls:
+                routing_result = self.data[asn]['as_routing_consistency']
+                for check in routing_result:
+                    results[asn][check] = routing_result[check]
         self.logger.info("Done")
         return results
+
+
+def _get_checked_on(result):
+    """
+    Return the 'checked_on' date of a parsed data call result.
+
+    """
+    if 'checked_on' in result:
+        return result['checked_on']
+    return next(iter(result.values()))['checked_on']
+
+
+def _parse_response(data_call, asn, response, checked_on):
+    """
+    Parse a data call's response with the data call's parser. Module level
+    so that it can run in a process pool.
+
+    """
+    parser = getattr(RIPEstatSourceData,
+                     RIPEstatSourceData.DATA_CALLS[data_call]['parser'])
+    return parser(asn, response, checked_on)
@@ -0,0 +1,394 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from datetime import date
+import gzip
+import ipaddress
+import logging
+import os
+
+from manrs.data_sources.ripestat import RIPEstatSourceData
+
+
+class RPSLError(Exception):
+    """
+    General error for RPSL dumps.
+
+    """
+    pass
+
+
+class RPSLInputError(RPSLError):
+    """
+    Error indicating wrong input.
+
+    """
+    pass
+
+
+def iter_rpsl_objects(filename, classes=None):
+    """
+    Stream the objects of a (gzip compressed) RPSL dump as
+    (class, [(key, value)]) tuples.
+
+    Keys are lowercased, continuation lines are joined to their attribute's
+    value and comments are removed. If 'classes' is given only objects of
+    these classes are parsed.
+
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, 'rt', encoding='utf-8', errors='replace') as f:
+        attributes = []
+        skip = False
+        for line in f:
+            if line.startswith(("#", "%")):
+                continue
+            line = line.rstrip("\n")
+            if not line.strip():
+                if attributes and not skip:
+                    yield attributes[0][0], attributes
+                attributes = []
+                skip = False
+                continue
+            if skip:
+                continue
+            if line[0] in " \t+":
+                if attributes:
+                    key, value = attributes[-1]
+                    attributes[-1] = (
+                        key, "{} {}".format(
+                            value, line[1:].split("#", 1)[0].strip()).strip())
+                continue
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+            key = key.strip().lower()
+            if not attributes and classes is not None and key not in classes:
+                skip = True
+                continue
+            attributes.append((key, value.split("#", 1)[0].strip()))
+        if attributes and not skip:
+            yield attributes[0][0], attributes
+
+
+class RPSLSourceData(object):
+    """
+    Class to handle locally stored RPSL database dumps (e.g. the split
+    aut-num, role and person dumps of the RIRs).
+
+    The dumps are streamed once for the aut-num objects and once more, only
+    the files that had any, for the role and person objects referenced by
+    them. Only aut-num objects of the RIRs' own databases are used.
+
+    """
+    # RPSL 'source' to RIPEstat whois authority.
+    AUTHORITIES = {
+        'RIPE': "ripe",
+        'APNIC': "apnic",
+        'AFRINIC': "afrinic",
+        'ARIN': "arin",
+        'LACNIC': "lacnic",
+    }
+    # The contact keys `RIPEstatSourceData._get_whois_result` looks for
+    # follow the authority's own whois. ARIN's RPSL aut-num objects reference
+    # their contacts with admin-c/tech-c as RIPE's do, not with the
+    # OrgTechRef/OrgNocRef of its whois.
+    CONTACT_AUTHORITIES = {
+        'arin': "ripe",
+    }
+    IMPORT_KEYS = ("import", "mp-import", "import-via")
+    EXPORT_KEYS = ("export", "mp-export", "export-via")
+    CONTACT_REFERENCE_KEYS = ("admin-c", "tech-c")
+    # The attributes used by `RIPEstatSourceData._get_whois_result`.
+    CONTACT_KEYS = ("admin-c", "tech-c", "orgtechref", "orgnocref", "person",
+                    "email", "e-mail", "phone")
+    CONTACT_CLASSES = ("role", "person")
+
+    def __init__(self, filenames, asns=None):
+        """
+        If 'asns' is given only the results of these ASNs are kept.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info("Starting module")
+        for filename in filenames:
+            if not os.path.isfile(filename):
+                raise RPSLInputError("Dump file ({}) does not exist!"
+                                     "".format(filename))
+        self.filenames = filenames
+        self.asns = set(asns) if asns is not None else None
+        self.checked_on = date.today().isoformat()
+        self.data = None
+
+    def _get_record(self, attributes):
+        """
+        Keep the attributes relevant for the contact information in the
+        whois data call's record format.
+
+        """
+        record = []
+        for key, value in attributes:
+            if key in self.CONTACT_KEYS:
+                if key == "orgtechref":
+                    key = "OrgTechRef"
+                elif key == "orgnocref":
+                    key = "OrgNocRef"
+                elif key == "e-mail":
+                    key = "email"
+                record.append({'key': key, 'value': value})
+        return record
+
+    def _parse_aut_num(self, attributes):
+        asn = None
+        authority = None
+        has_imports = False
+        has_exports = False
+        for key, value in attributes:
+            if key == "aut-num":
+                try:
+                    asn = int(value.upper().replace("AS", "", 1))
+                except ValueError:
+                    return None
+            elif key == "source":
+                authority = self.AUTHORITIES.get(value.upper())
+            elif key in self.IMPORT_KEYS and value:
+                has_imports = True
+            elif key in self.EXPORT_KEYS and value:
+                has_exports = True
+        if asn is None or authority is None:
+            return None
+        if self.asns is not None and asn not in self.asns:
+            return None
+        return asn, {
+            'authority': authority,
+            'has_imports': has_imports,
+            'has_exports': has_exports,
+            'record': self._get_record(attributes),
+            'contacts': [value.upper() for key, value in attributes
+                         if key in self.CONTACT_REFERENCE_KEYS and value],
+        }
+
+    def fetch_data(self):
+        """
+        Parse the dumps.
+
+        """
+        self.logger.info("Parsing aut-num objects")
+        aut_nums = {}
+        contact_files = []
+        for filename in self.filenames:
+            has_contacts = False
+            for obj_class, attributes in iter_rpsl_objects(
+                    filename, ("aut-num",) + self.CONTACT_CLASSES):
+                if obj_class != "aut-num":
+                    has_contacts = True
+                    continue
+                aut_num = self._parse_aut_num(attributes)
+                if aut_num:
+                    asn, aut_num = aut_num
+                    aut_nums[asn] = aut_num
+            if has_contacts:
+                contact_files.append(filename)
+
+        self.logger.info("Parsing role and person objects")
+        referenced = {nic_hdl for aut_num in aut_nums.values()
+                      for nic_hdl in aut_num['contacts']}
+        contacts = {}
+        for filename in contact_files:
+            for obj_class, attributes in iter_rpsl_objects(
+                    filename, self.CONTACT_CLASSES):
+                nic_hdl = next((value.upper() for key, value in attributes
+                                if key == "nic-hdl"), None)
+                if nic_hdl in referenced:
+                    contacts[nic_hdl] = self._get_record(attributes)
+
+        data = {}
+        for asn, aut_num in aut_nums.items():
+            records = [aut_num['record']]
+            for nic_hdl in aut_num['contacts']:
+                if nic_hdl in contacts:
+                    records.append(contacts[nic_hdl])
+            data[asn] = {
+                'has_imports': aut_num['has_imports'],
+                'has_exports': aut_num['has_exports'],
+                'whois': {
+                    'data': {
+                        'authorities': [self.CONTACT_AUTHORITIES.get(
+                            aut_num['authority'], aut_num['authority'])],
+                        'records': records,
+                    },
+                },
+            }
+        self.logger.info("Found {} aut-num objects".format(len(data)))
+        self.data = data
+
+    def get_results(self):
+        """
+        Return the 'imports_exports' and 'contact_info' results per ASN in
+        the format of `RIPEstatSourceData.get_results`. ASNs without an
+        aut-num object get None values.
+
+        """
+        self.logger.info("Getting results")
+        asns = self.asns if self.asns is not None else set(self.data)
+        results = {}
+        for asn in asns:
+            data = self.data.get(asn)
+            results[asn] = {
+                'imports_exports': {
+                    'has_imports': data['has_imports'] if data else None,
+                    'has_exports': data['has_exports'] if data else None,
+                    'checked_on': self.checked_on,
+                },
+                'contact_info': RIPEstatSourceData._get_whois_result(
+                    asn, data['whois'] if data else None, self.checked_on),
+            }
+        self.logger.info("Done")
+        return results
+
+
+def _normalise_prefix(prefix):
+    """
+    Return the canonical form of the prefix or None if it is invalid.
+
+    """
+    try:
+        return str(ipaddress.ip_network(prefix.strip(), strict=False))
+    except ValueError:
+        return None
+
+
+class RPSLRoutingSourceData(object):
+    """
+    Class to calculate the registered routes of ASNs offline from locally
+    stored IRR route/route6 object dumps and a routing table snapshot.
+
+    The snapshot is a (gzip compressed) text file with an announced prefix
+    and its origin per line, either as 'prefix origin' or in the CAIDA
+    prefix-to-AS format ('address length origin'). Multi-origin ('1_2') and
+    AS set ('1,2') origins count for each of their ASNs.
+
+    """
+    ROUTE_CLASSES = ("route", "route6")
+
+    def __init__(self, route_filenames, rib_filename, asns=None):
+        """
+        If 'asns' is given only the results of these ASNs are kept.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.logger.info("Starting module")
+        for filename in list(route_filenames) + [rib_filename]:
+            if not os.path.isfile(filename):
+                raise RPSLInputError("Dump file ({}) does not exist!"
+                                     "".format(filename))
+        self.route_filenames = route_filenames
+        self.rib_filename = rib_filename
+        self.asns = set(asns) if asns is not None else None
+        self.checked_on = date.today().isoformat()
+        self.registered = None
+        self.announced = None
+
+    def _add(self, index, asn, prefix):
+        if self.asns is not None and asn not in self.asns:
+            return
+        prefix = _normalise_prefix(prefix)
+        if prefix:
+            index.setdefault(asn, set()).add(prefix)
+
+    @staticmethod
+    def _parse_asns(string):
+        asns = []
+        for asn in string.replace("_", ",").split(","):
+            asn = asn.strip().upper()
+            if asn.startswith("AS"):
+                asn = asn[2:]
+            if asn.isdigit():
+                asns.append(int(asn))
+        return asns
+
+    def _parse_routes(self):
+        """
+        Index the prefixes of the route objects per origin ASN.
+
+        """
+        registered = {}
+        for filename in self.route_filenames:
+            for obj_class, attributes in iter_rpsl_objects(
+                    filename, self.ROUTE_CLASSES):
+                prefix = attributes[0][1]
+                for key, value in attributes:
+                    if key == "origin":
+                        for asn in self._parse_asns(value):
+                            self._add(registered, asn, prefix)
+                        break
+        return registered
+
+    def _parse_rib(self):
+        """
+        Index the announced prefixes of the snapshot per origin ASN.
+
+        """
+        announced = {}
+        opener = gzip.open if self.rib_filename.endswith(".gz") else open
+        with opener(self.rib_filename, 'rt') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 2:
+                    prefix, origins = fields
+                elif len(fields) == 3:
+                    prefix = "{}/{}".format(fields[0], fields[1])
+                    origins = fields[2]
+                else:
+                    continue
+                for asn in self._parse_asns(origins):
+                    self._add(announced, asn, prefix)
+        return announced
+
+    def fetch_data(self):
+        """
+        Parse the route object dumps and the routing table snapshot.
+
+        """
+        self.logger.info("Parsing route objects")
+        self.registered = self._parse_routes()
+        self.logger.info("Parsing routing table snapshot")
+        self.announced = self._parse_rib()
+
+    def get_results(self):
+        """
+        Return the 'unregistered_routes' results per ASN in the format of
+        `RIPEstatSourceData.get_results`.
+
+        As in RIPEstat's as-routing-consistency data call, the routes of an
+        ASN are its announced prefixes together with its route objects; the
+        route objects are the registered ones and the rest are checked the
+        same way.
+
+        """
+        self.logger.info("Getting results")
+        asns = self.asns
+        if asns is None:
+            asns = set(self.registered) | set(self.announced)
+        results = {}
+        for asn in asns:
+            registered = self.registered.get(asn, set())
+            announced = self.announced.get(asn, set())
+            prefixes = [{'prefix': prefix, 'in_whois': True}
+                        for prefix in sorted(registered)]
+            prefixes.extend({'prefix': prefix, 'in_whois': False}
+                            for prefix in sorted(announced - registered))
+            data = {
+                'data': {
+                    'imports': [],
+                    'exports': [],
+                    'prefixes': prefixes,
+                },
+            }
+            result = RIPEstatSourceData._get_as_routing_consistency_result(
+                asn, data, self.checked_on)
+            results[asn] = {
+                'unregistered_routes': result['unregistered_routes'],
+            }
+        self.logger.info("Done")
+        return results
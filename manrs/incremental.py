@@ -0,0 +1,344 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from datetime import datetime, timedelta
+import json
+import logging
+
+from manrs.metrics import (
+    METRICS, WeightedDurationMetric, _calculate_incident_score, _dispatch,
+    _merge_incidents, _stringify_datetimes, get_results_per_asn)
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalStateError(Exception):
+    """
+    General error for the incremental state.
+
+    """
+    pass
+
+
+def _state_metrics():
+    """
+    Return the registered metrics that are kept in the incremental state.
+
+    """
+    return [metric for metric in METRICS.values()
+            if isinstance(metric, WeightedDurationMetric)]
+
+
+def _parse_isoformat(string):
+    """
+    Parse a datetime serialised with `datetime.isoformat`.
+
+    """
+    if "." in string:
+        return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S.%f")
+    return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S")
+
+
+def _merge_event_pieces(data):
+    """
+    Merge the per day pieces of the same BGPStream event back into a single
+    record, as it is given for the whole period: its start and end are
+    extended and the durations of its pieces summed up.
+
+    Pieces are matched on the event and the weight as an ASN can hold
+    multiple records of the same event, e.g. a leak whose leaked_to ASN is
+    also a hop of the AS path. Identical records of a day (sharing their
+    start time) are matched in order to those of the other days.
+
+    """
+    merged = []
+    events = {}
+    occurrences = {}
+    for record in data:
+        event_id = record.get('bgpstream_eventid')
+        if event_id is None:
+            merged.append(record)
+            continue
+        key = (event_id, record.get('weight'))
+        records = events.setdefault(key, [])
+        index = occurrences.get((key, record['start_time']), 0)
+        occurrences[(key, record['start_time'])] = index + 1
+        if index == len(records):
+            records.append(dict(record))
+            merged.append(records[-1])
+        else:
+            event = records[index]
+            event['start_time'] = min(event['start_time'],
+                                      record['start_time'])
+            event['end_time'] = max(event['end_time'], record['end_time'])
+            event['duration'] += record['duration']
+    return merged
+
+
+def _rebuild_entry(entry, folded_end):
+    """
+    Recalculate the score and the open incidents of an entry from all of
+    its data, as if its days were folded in one go up to 'folded_end'.
+
+    """
+    incidents = _merge_incidents([
+        {
+            'start_time': _parse_isoformat(record['start_time']),
+            'end_time': _parse_isoformat(record['end_time']),
+            'weight': record['weight'],
+        }
+        for record in entry['data']])
+    entry['score'] = 0
+    entry['incidents'] = []
+    for incident in incidents:
+        if incident['end_time'] < folded_end:
+            entry['score'] += _calculate_incident_score(incident)
+        else:
+            entry['incidents'].append(incident)
+
+
+class IncrementalState(object):
+    """
+    Running state of the duration based metrics (m1, m1c, m2, m2c and m3)
+    for a period that is still in progress.
+
+    The period is processed one day at a time with `fold`. For every ASN and
+    metric the state keeps:
+        - the incidents that may still be extended by the next day's events
+          (open incidents);
+        - the summed score of the incidents that can no longer change;
+        - the data used for calculating the metric.
+
+    Because events are clipped at the day's edges, an event spanning
+    multiple days is folded in as consecutive pieces that touch each other
+    and are merged back into the same incident. The pieces are kept in the
+    data and merged back into a single event on `get_results`.
+
+    """
+    def __init__(self, period_start, period_end):
+        if period_start >= period_end:
+            raise IncrementalStateError("Period start later than period end!")
+        self.period_start = period_start
+        self.period_end = period_end
+        self.folded_days = []
+        self.asns = {}
+
+    def _get_entry(self, asn, metric):
+        metrics = self.asns.setdefault(asn, {})
+        return metrics.setdefault(metric.name, {
+            'score': 0,
+            'incidents': [],
+            'data': [],
+        })
+
+    def fold(self, day_start, day_end, asns, bgp_stream_results,
+             cidr_results):
+        """
+        Fold the results of a single day into the state.
+
+        `bgp_stream_results` and `cidr_results` need to be limited to
+        the [day_start, day_end) period. Days need to be folded in
+        chronological order as incidents that do not touch the end of the
+        day are closed; a missed day can only be folded before any later
+        day is.
+
+        A day that is already part of the state can be folded again, e.g.
+        for events BGPStream reported late; its pieces are replaced and the
+        affected entries recalculated from their data. Late events that are
+        still active on the following days are only complete once those
+        days are folded again as well.
+
+        """
+        if day_start < self.period_start or day_end > self.period_end:
+            raise IncrementalStateError(
+                "Day ({}) is not within the state's period!".format(
+                    day_start.date()))
+        if day_end - day_start != timedelta(days=1):
+            raise IncrementalStateError(
+                "Only a single day can be folded, not {} - {}!".format(
+                    day_start, day_end))
+        day = day_start.date().isoformat()
+        refold = day in self.folded_days
+        if (not refold and self.folded_days
+                and day < self.folded_days[-1]):
+            raise IncrementalStateError(
+                "Day ({}) is earlier than the last folded day ({})!".format(
+                    day, self.folded_days[-1]))
+
+        if refold:
+            logger.info("Folding {} again into the state".format(day))
+        else:
+            logger.info("Folding {} into the state".format(day))
+        metrics = _state_metrics()
+        sources = {
+            'bgp_stream': bgp_stream_results,
+            'cidr': cidr_results,
+        }
+        buckets = {}
+        for asn in asns:
+            buckets[asn] = {}
+            for metric in metrics:
+                buckets[asn][metric.data_key] = metric.new_data()
+        _dispatch(asns, buckets, sources, metrics)
+
+        if refold:
+            self._refold(day_start, day_end, buckets, metrics)
+            return
+
+        for asn in set(buckets) | set(self.asns):
+            for metric in metrics:
+                records = buckets.get(asn, {}).get(metric.data_key)
+                if not records and metric.name not in self.asns.get(asn, {}):
+                    continue
+                entry = self._get_entry(asn, metric)
+                if records:
+                    incidents = _merge_incidents(
+                        entry['incidents'] + records)
+                    for record in records:
+                        _stringify_datetimes(record)
+                    entry['data'].extend(records)
+                else:
+                    incidents = entry['incidents']
+                # Only incidents touching the end of the day can be extended
+                # by the next day's events.
+                entry['incidents'] = []
+                for incident in incidents:
+                    if incident['end_time'] < day_end:
+                        entry['score'] += _calculate_incident_score(incident)
+                    else:
+                        entry['incidents'].append(incident)
+
+        self.folded_days.append(day)
+
+    def _refold(self, day_start, day_end, buckets, metrics):
+        """
+        Replace the pieces of an already folded day with the given ones.
+
+        """
+        day_start_string = day_start.isoformat()
+        day_end_string = day_end.isoformat()
+        folded_end = datetime.strptime(
+            self.folded_days[-1], "%Y-%m-%d") + timedelta(days=1)
+        for asn in set(buckets) | set(self.asns):
+            for metric in metrics:
+                records = buckets.get(asn, {}).get(metric.data_key)
+                if not records and metric.name not in self.asns.get(asn, {}):
+                    continue
+                entry = self._get_entry(asn, metric)
+                data = [record for record in entry['data']
+                        if not (day_start_string <= record['start_time']
+                                < day_end_string)]
+                for record in records or []:
+                    _stringify_datetimes(record)
+                    data.append(record)
+                if data == entry['data']:
+                    continue
+                entry['data'] = data
+                _rebuild_entry(entry, folded_end)
+
+    def get_results(self):
+        """
+        Return the provisional results per ASN for the kept metrics.
+
+        """
+        results = {}
+        for asn, metrics in self.asns.items():
+            results[asn] = {}
+            for metric in _state_metrics():
+                entry = metrics.get(metric.name)
+                if not entry:
+                    results[asn][metric.name] = metric.default
+                    results[asn][metric.data_key] = metric.new_data()
+                    continue
+                results[asn][metric.name] = entry['score'] + sum(
+                    _calculate_incident_score(incident)
+                    for incident in entry['incidents'])
+                results[asn][metric.data_key] = metric.get_stored_data(
+                    _merge_event_pieces(entry['data']))
+        return results
+
+    def finalise(self, asns, ripestat_results):
+        """
+        Return the final results per ASN for the period by combining the
+        state with the metrics that are not kept in the state.
+
+        """
+        missing_days = (self.period_end - self.period_start).days - len(
+            self.folded_days)
+        if missing_days:
+            logger.warning("{} days of the period are not part of the "
+                           "state".format(missing_days))
+
+        state_metrics = _state_metrics()
+        other_metrics = [metric for metric in METRICS.values()
+                         if metric not in state_metrics]
+        state_results = self.get_results()
+        other_results = get_results_per_asn(
+            asns, None, None, ripestat_results, metrics=other_metrics)
+
+        results = {}
+        for asn in asns:
+            results[asn] = {}
+            for metric in METRICS.values():
+                if metric in state_metrics and asn in state_results:
+                    result = state_results[asn]
+                elif metric in state_metrics:
+                    result = {
+                        metric.name: metric.default,
+                        metric.data_key: metric.new_data(),
+                    }
+                else:
+                    result = other_results[asn]
+                results[asn][metric.name] = result[metric.name]
+                results[asn][metric.data_key] = result[metric.data_key]
+        return results
+
+    def save(self, filename):
+        """
+        Persist the state in JSON format.
+
+        """
+        asns = {}
+        for asn, metrics in self.asns.items():
+            asns[asn] = {}
+            for name, entry in metrics.items():
+                asns[asn][name] = {
+                    'score': entry['score'],
+                    'incidents': [
+                        {
+                            'start_time': incident['start_time'].isoformat(),
+                            'end_time': incident['end_time'].isoformat(),
+                            'weight': incident['weight'],
+                        }
+                        for incident in entry['incidents']],
+                    'data': entry['data'],
+                }
+        state = {
+            'period_start': self.period_start.isoformat(),
+            'period_end': self.period_end.isoformat(),
+            'folded_days': self.folded_days,
+            'asns': asns,
+        }
+        with open(filename, 'w') as f:
+            json.dump(state, f, default=str)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a state persisted with `save`.
+
+        """
+        with open(filename, 'r') as f:
+            state = json.load(f)
+        obj = cls(_parse_isoformat(state['period_start']),
+                  _parse_isoformat(state['period_end']))
+        obj.folded_days = state['folded_days']
+        for asn, metrics in state['asns'].items():
+            obj.asns[int(asn)] = metrics
+            for entry in metrics.values():
+                for incident in entry['incidents']:
+                    incident['start_time'] = _parse_isoformat(
+                        incident['start_time'])
+                    incident['end_time'] = _parse_isoformat(
+                        incident['end_time'])
+        return obj
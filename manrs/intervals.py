@@ -0,0 +1,132 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import logging
+
+from manrs.metrics import (
+    METRICS, WeightedDurationMetric, _calculate_incident_score, _dispatch,
+    _merge_incidents)
+
+logger = logging.getLogger(__name__)
+
+
+class IncidentIndex(object):
+    """
+    Interval index over the incidents of the duration based metrics (m1, m1c,
+    m2, m2c and m3) per ASN.
+
+    The events are merged once into incidents which are kept sorted per ASN,
+    metric and weight together with the cumulative sum of their scores. The
+    score of an ASN for any window within the indexed period can then be
+    answered in logarithmic time; only the (at most two) incidents crossing
+    the window's edges need to be clipped and scored. Clipping works like
+    `BGPEvent._curate_start_end_times`.
+
+    """
+    def __init__(self):
+        self._index = {}
+
+    @classmethod
+    def from_results(cls, asns, bgp_stream_results, cidr_results):
+        """
+        Create the index from the results of the BGPStream and CIDR report
+        data sources for the whole indexed period.
+
+        """
+        metrics = [metric for metric in METRICS.values()
+                   if isinstance(metric, WeightedDurationMetric)]
+        buckets = {}
+        for asn in asns:
+            buckets[asn] = {}
+            for metric in metrics:
+                buckets[asn][metric.data_key] = metric.new_data()
+        sources = {
+            'bgp_stream': bgp_stream_results,
+            'cidr': cidr_results,
+        }
+        _dispatch(asns, buckets, sources, metrics)
+
+        index = cls()
+        for asn, bucket in buckets.items():
+            for metric in metrics:
+                index.add(asn, metric.name, bucket[metric.data_key])
+        return index
+
+    def add(self, asn, metric, events):
+        """
+        Index the events of an ASN for the given metric.
+
+        """
+        incidents_per_weight = {}
+        for incident in _merge_incidents(events):
+            incidents_per_weight.setdefault(
+                incident['weight'], []).append(incident)
+
+        groups = self._index.setdefault((asn, metric), [])
+        for weight, incidents in incidents_per_weight.items():
+            incidents.sort(key=lambda x: x['start_time'])
+            start_times = [x['start_time'] for x in incidents]
+            end_times = [x['end_time'] for x in incidents]
+            cumulative_scores = [0] + list(accumulate(
+                _calculate_incident_score(x) for x in incidents))
+            groups.append((weight, start_times, end_times,
+                           cumulative_scores))
+
+    @staticmethod
+    def _clipped_score(weight, start_time, end_time, window_start,
+                       window_end):
+        curated_start_time = max(start_time, window_start)
+        curated_end_time = max(min(end_time, window_end), curated_start_time)
+        return _calculate_incident_score({
+            'start_time': curated_start_time,
+            'end_time': curated_end_time,
+            'weight': weight,
+        })
+
+    def get_score(self, asn, metric, window_start, window_end):
+        """
+        Return the score of an ASN for the given metric over the
+        [window_start, window_end) window.
+
+        """
+        score = 0
+        for weight, start_times, end_times, cumulative_scores in (
+                self._index.get((asn, metric), [])):
+            # Incidents are disjoint so both their start and end times are
+            # sorted.
+            first = bisect_left(end_times, window_start)
+            last = bisect_right(start_times, window_end) - 1
+            if first > last:
+                continue
+
+            edges = set()
+            inner_first = first
+            inner_last = last
+            if start_times[first] < window_start:
+                edges.add(first)
+                inner_first += 1
+            if end_times[last] > window_end:
+                edges.add(last)
+                inner_last -= 1
+            if inner_first <= inner_last:
+                score += (cumulative_scores[inner_last + 1]
+                          - cumulative_scores[inner_first])
+            for edge in edges:
+                score += self._clipped_score(
+                    weight, start_times[edge], end_times[edge],
+                    window_start, window_end)
+        return score
+
+    def get_scores(self, window_start, window_end):
+        """
+        Return the scores of all the indexed ASNs and metrics over the
+        [window_start, window_end) window as {asn: {metric: score}}.
+
+        """
+        results = {}
+        for asn, metric in self._index:
+            results.setdefault(asn, {})[metric] = self.get_score(
+                asn, metric, window_start, window_end)
+        return results
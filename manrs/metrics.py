@@ -1,9 +1,14 @@
 # Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging
 
+import numpy as np
+
+from manrs import settings
 from manrs.settings import *
 
 logger = logging.getLogger(__name__)
@@ -22,251 +27,662 @@ def _stringify_datetimes(dictionary):
             dictionary[key] = dictionary[key].isoformat()
 
 
-def _calculate_weighted_duration(events):
+def _merge_incidents(events, with_events=False):
     """
-    Create incidents from continuous events and weight them based on their
-    combined duration. Note that only events that share the same weight can
-    form an incident.
-
-    More specifically:
+    Create incidents from continuous events. Note that only events that share
+    the same weight can form an incident.
 
     An incident is considered to be one or multiple events that happen at the
     same time span. These events could happen at the same time and/or may
-    also be a chain of events.
+    also be a chain of events; events touching at their edges are part of the
+    same incident.
+
+    Events are grouped by weight and sorted by start time so that each group
+    can be merged in a single sweep.
+
+    If `with_events` is set each incident also lists its events under
+    'events'.
+
+    """
+    intervals_per_weight = {}
+    for index, event in enumerate(events):
+        intervals_per_weight.setdefault(event['weight'], []).append(
+            (event['start_time'], event['end_time'], index))
+
+    incidents = []
+    for weight, intervals in intervals_per_weight.items():
+        intervals.sort()
+        curr_start, curr_end, _ = intervals[0]
+        curr_events = []
+        for start_time, end_time, index in intervals:
+            if start_time > curr_end:
+                incidents.append({
+                    'start_time': curr_start,
+                    'end_time': curr_end,
+                    'weight': weight,
+                })
+                if with_events:
+                    incidents[-1]['events'] = curr_events
+                curr_start = start_time
+                curr_events = []
+            curr_end = max(curr_end, end_time)
+            curr_events.append(index)
+        incidents.append({
+            'start_time': curr_start,
+            'end_time': curr_end,
+            'weight': weight,
+        })
+        if with_events:
+            incidents[-1]['events'] = curr_events
+
+    if with_events:
+        for incident in incidents:
+            incident['events'] = [events[index]
+                                  for index in incident['events']]
+    return incidents
+
+
+def _summarise_incidents(events):
+    """
+    Return the incidents of the events in a compact form for storage.
 
-    Each incident is normalized based on duration and weight like so:
+    Instead of the events each incident references the BGPStream event ids of
+    its events; for events without an id (e.g. CIDR report) the prefixes are
+    referenced instead.
+
+    """
+    return _summarise_merged_incidents(
+        _merge_incidents(events, with_events=True))
+
+
+def _summarise_merged_incidents(incidents):
+    """
+    Variant of `_summarise_incidents` for incidents already merged with
+    `_merge_incidents(events, with_events=True)`. The incidents are updated
+    in place.
+
+    """
+    for incident in incidents:
+        incident_events = incident.pop('events')
+        if all('bgpstream_eventid' in event for event in incident_events):
+            incident['bgpstream_eventids'] = sorted(set(
+                event['bgpstream_eventid'] for event in incident_events))
+        else:
+            incident['prefixes'] = sorted(set(
+                event['prefix'] for event in incident_events))
+        _stringify_datetimes(incident)
+    incidents.sort(key=lambda x: (x['start_time'], x['weight']))
+    return incidents
+
+
+def _calculate_incident_score(incident):
+    """
+    Normalize an incident based on its duration and weight like so:
         - 0,                duration == 0;
         - 0.5 * weight,     duration < INCIDENT_ACCEPTABLE_DURATION;
         - 1.0 * weight,     duration < INCIDENT_TOLERANT_DURATION;
         - 1.0 * weight * 2, penalty for every INCIDENT_TOLERANT_DURATION.
 
+    """
+    duration = (incident['end_time']
+                - incident['start_time']).total_seconds()
+    if not duration:
+        return 0
+
+    intolerant_num, seconds = divmod(duration, INCIDENT_TOLERANT_DURATION)
+    if intolerant_num:
+        if INCIDENT_INTOLERANT_PENALTY == "exponential":
+            score = 2**intolerant_num
+        elif INCIDENT_INTOLERANT_PENALTY == "linear":
+            score = intolerant_num + 1
+        else:
+            logger.critical("Unknown value for INCIDENT_INTOLERANT_PENALTY"
+                            ": '{}'".format(INCIDENT_INTOLERANT_PENALTY))
+    else:
+        if seconds < INCIDENT_ACCEPTABLE_DURATION:
+            score = INCIDENT_ACCEPTABLE_SCORE
+        else:
+            score = INCIDENT_TOLERANT_SCORE
+    return score * incident['weight']
+
+
+def _calculate_weighted_duration(events):
+    """
+    Create incidents from continuous events and weight them based on their
+    combined duration. See `_merge_incidents` and
+    `_calculate_incident_score` for details.
+
     The total is then the sum of all the incident's score.
 
     """
-    incidents = {}
-    incident_id = 0
+    incidents = _merge_incidents(events)
     for event in events:
-        keep_looking = True
-        curr_incident = {
-            'start_time': event['start_time'],
-            'end_time':event['end_time'],
-            'weight': event['weight'],
-        }
         _stringify_datetimes(event)
-        while keep_looking:
-            for id, incident in incidents.items():
-                # Events sharing an incident need to have the same weight.
-                if curr_incident['weight'] != incident['weight']:
-                    continue
-                # curr_incident is not touching this incident; continue
-                elif (
-                    curr_incident['start_time'] < incident['start_time']
-                    and curr_incident['end_time'] < incident['start_time']
-                    or (curr_incident['start_time'] > incident['end_time']
-                        and curr_incident['end_time'] > incident['end_time'])):
-                    logger.debug("new")
-                    continue
-                # curr_incident is within this incident;
-                # ignore curr_incident
-                elif (curr_incident['start_time'] > incident['start_time']
-                        and curr_incident['end_time'] < incident['end_time']):
-                    logger.debug("ignore")
-                    keep_looking = False
-                    break
-                # need to merge these incidents
-                # remove incident and keep looking in case another incident
-                #  may now be merged
-                else:
-                    curr_incident['start_time'] = min(
-                        curr_incident['start_time'], incident['start_time'])
-                    curr_incident['end_time'] = max(
-                        curr_incident['end_time'], incident['end_time'])
-                    logger.debug("Popping: {}".format(incident))
-                    incidents.pop(id)
-                    break
-            # No breaks, means new incident
-            else:
-                logger.debug("Creating: {}".format(curr_incident))
-                incidents[incident_id] = curr_incident
-                incident_id += 1
-                keep_looking = False
-
-    # Calculate score
-    scores = []
-    for _, incident in incidents.items():
-        duration = (incident['end_time']
-                    - incident['start_time']).total_seconds()
-        if not duration:
-            continue
+    return sum(_calculate_incident_score(incident) for incident in incidents)
 
-        intolerant_num, seconds = divmod(duration, INCIDENT_TOLERANT_DURATION)
-        if intolerant_num:
-            if INCIDENT_INTOLERANT_PENALTY == "exponential":
-                score = 2**intolerant_num
-            elif INCIDENT_INTOLERANT_PENALTY == "linear":
-                score = intolerant_num + 1
-            else:
-                logger.critical("Unknown value for INCIDENT_INTOLERANT_PENALTY"
-                                ": '{}'".format(INCIDENT_INTOLERANT_PENALTY))
-        else:
-            if seconds < INCIDENT_ACCEPTABLE_DURATION:
-                score = INCIDENT_ACCEPTABLE_SCORE
-            else:
-                score = INCIDENT_TOLERANT_SCORE
-        score *= incident['weight']
-        scores.append(score)
 
-    return sum(scores)
+def get_scoring_settings():
+    """
+    Return the settings used for scoring incidents.
+
+    """
+    return {
+        'INCIDENT_ACCEPTABLE_DURATION': INCIDENT_ACCEPTABLE_DURATION,
+        'INCIDENT_ACCEPTABLE_SCORE': INCIDENT_ACCEPTABLE_SCORE,
+        'INCIDENT_TOLERANT_DURATION': INCIDENT_TOLERANT_DURATION,
+        'INCIDENT_TOLERANT_SCORE': INCIDENT_TOLERANT_SCORE,
+        'INCIDENT_INTOLERANT_PENALTY': INCIDENT_INTOLERANT_PENALTY,
+    }
 
 
-def _update_results_m1(asns, results, bgp_stream_results):
+def _score_incidents(start_times, end_times, weights, owners, owners_num,
+                     scoring=None):
     """
-    Calculate metric m1 and also attach the appropriate data.
+    Vectorized counterpart of `_calculate_incident_score`.
+
+    Takes the incidents of all owners (e.g. ASNs) as flat arrays and returns
+    an array with the summed score per owner index.
+
+    The scoring settings default to the ones in `manrs.settings`; see
+    `get_scoring_settings` for the ones that can be given in `scoring`.
 
     """
-    logger.info("Calculating m1")
-    for culprit in bgp_stream_results['bgp_leak']['culprits']:
-        if culprit['asn'] in asns:
-            asn = culprit.pop('asn')
-            results[asn]['m1_data'].append(culprit)
-    for asn, result in results.items():
-        result['m1'] = _calculate_weighted_duration(result['m1_data'])
+    if scoring is None:
+        scoring = get_scoring_settings()
+    penalty = scoring['INCIDENT_INTOLERANT_PENALTY']
+    durations = (end_times - start_times) / np.timedelta64(1, 's')
+    intolerant_num, seconds = np.divmod(
+        durations, scoring['INCIDENT_TOLERANT_DURATION'])
+    if penalty == "exponential":
+        intolerant_scores = np.exp2(intolerant_num)
+    elif penalty == "linear":
+        intolerant_scores = intolerant_num + 1
+    else:
+        logger.critical("Unknown value for INCIDENT_INTOLERANT_PENALTY"
+                        ": '{}'".format(penalty))
+        raise ValueError("Unknown value for INCIDENT_INTOLERANT_PENALTY: "
+                         "'{}'".format(penalty))
+    tolerant_scores = np.where(
+        seconds < scoring['INCIDENT_ACCEPTABLE_DURATION'],
+        scoring['INCIDENT_ACCEPTABLE_SCORE'],
+        scoring['INCIDENT_TOLERANT_SCORE'])
+    scores = np.where(intolerant_num > 0, intolerant_scores, tolerant_scores)
+    scores = np.where(durations > 0, scores * weights, 0.0)
+    return np.bincount(owners, weights=scores, minlength=owners_num)
+
+
+def _flatten_incidents(events_lists):
+    """
+    Merge the events of each list into incidents and return them as flat
+    (start_times, end_times, weights, owners) arrays, where owner is the index
+    of the list the incident came from.
 
+    """
+    return _flatten_merged_incidents(
+        [_merge_incidents(events) for events in events_lists])
 
-def _update_results_m1c(asns, results, bgp_stream_results):
+
+def _flatten_merged_incidents(incidents_lists):
     """
-    Calculate metric m1c and also attach the appropriate data.
+    Variant of `_flatten_incidents` for lists of already merged incidents.
 
     """
-    logger.info("Calculating m1c")
-    for accomplice in bgp_stream_results['bgp_leak']['accomplices']:
-        if accomplice['asn'] in asns:
-            asn = accomplice.pop('asn')
-            results[asn]['m1c_data'].append(accomplice)
-    for asn, result in results.items():
-        result['m1c'] = _calculate_weighted_duration(result['m1c_data'])
+    start_times = []
+    end_times = []
+    weights = []
+    owners = []
+    for owner, incidents in enumerate(incidents_lists):
+        for incident in incidents:
+            start_times.append(incident['start_time'])
+            end_times.append(incident['end_time'])
+            weights.append(incident['weight'])
+            owners.append(owner)
+    return (np.array(start_times, dtype='datetime64[us]'),
+            np.array(end_times, dtype='datetime64[us]'),
+            np.array(weights, dtype=float),
+            np.array(owners, dtype=np.intp))
+
+
+def _calculate_weighted_durations(events_lists, scoring=None):
+    """
+    Batch variant of `_calculate_weighted_duration`.
 
+    Merges the events of each list into incidents and scores all the
+    incidents at once. Returns the list of scores in the order of the given
+    event lists. See `_score_incidents` for `scoring`.
 
-def _update_results_m2(asns, results, bgp_stream_results):
     """
-    Calculate metric m2 and also attach the appropriate data.
+    incidents = _flatten_incidents(events_lists)
+    for events in events_lists:
+        for event in events:
+            _stringify_datetimes(event)
+    scores = _score_incidents(*incidents, len(events_lists), scoring=scoring)
+    return scores.tolist()
 
+
+class Metric(object):
     """
-    logger.info("Calculating m2")
-    for culprit in bgp_stream_results['bgp_hijack']['culprits']:
-        if culprit['asn'] in asns:
-            asn = culprit.pop('asn')
-            results[asn]['m2_data'].append(culprit)
-    for asn, result in results.items():
-        result['m2'] = _calculate_weighted_duration(result['m2_data'])
+    Base class for metrics.
 
+    A metric declares the data source it is calculated from and the stream of
+    records within that source's results. The records of the stream are
+    routed to the metric's ASN buckets (`<name>_data`) and the metric's value
+    is calculated from them.
 
-def _update_results_m2c(asns, results, bgp_stream_results):
     """
-    Calculate metric m2c and also attach the appropriate data.
+    default = None
+
+    def __init__(self, name, source, stream):
+        self.name = name
+        self.source = source
+        self.stream = stream
+        self.data_key = "{}_data".format(name)
+
+    def new_data(self):
+        """
+        Return the initial data of an ASN bucket.
+
+        """
+        return []
+
+    def add_data(self, data, record):
+        """
+        Add a routed record to the data of an ASN bucket and return the
+        updated data.
+
+        """
+        data.append(record)
+        return data
+
+    def calculate(self, data):
+        """
+        Calculate the metric's value from the data of an ASN bucket.
+
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def calculate_batch(items):
+        """
+        Calculate the values for a batch of (metric, data) items. Metrics of
+        the same class are calculated in a single batch.
+
+        """
+        return [metric.calculate(data) for metric, data in items]
 
+    def get_stored_data(self, data):
+        """
+        Return the data of an ASN bucket in the form they are stored in.
+
+        """
+        return data
+
+    @classmethod
+    def calculate_and_store_batch(cls, items):
+        """
+        Return the values and the stored data for a batch of (metric, data)
+        items. See `calculate_batch` and `get_stored_data`.
+
+        """
+        stored_data = [metric.get_stored_data(data) for metric, data in items]
+        return cls.calculate_batch(items), stored_data
+
+
+class WeightedDurationMetric(Metric):
+    """
+    Metric based on the weighted duration of incidents. See
+    `_calculate_weighted_duration`.
+
+    """
+    default = 0
+
+    def calculate(self, data):
+        return _calculate_weighted_duration(data)
+
+    @staticmethod
+    def calculate_batch(items):
+        return _calculate_weighted_durations([data for _, data in items])
+
+    def get_stored_data(self, data):
+        if settings.DURATION_DATA_STORAGE == "incidents":
+            return _summarise_incidents(data)
+        return data
+
+    @classmethod
+    def calculate_and_store_batch(cls, items):
+        """
+        The events of each ASN bucket are merged once; the same incidents are
+        scored and, when storing incidents, summarised.
+
+        """
+        if settings.DURATION_DATA_STORAGE != "incidents":
+            return super().calculate_and_store_batch(items)
+        incidents_lists = [_merge_incidents(data, with_events=True)
+                           for _, data in items]
+        scores = _score_incidents(
+            *_flatten_merged_incidents(incidents_lists), len(items))
+        for _, data in items:
+            for event in data:
+                _stringify_datetimes(event)
+        stored_data = [_summarise_merged_incidents(incidents)
+                       for incidents in incidents_lists]
+        return scores.tolist(), stored_data
+
+
+class PrecomputedMetric(Metric):
     """
-    logger.info("Calculating m2c")
-    for accomplice in bgp_stream_results['bgp_hijack']['accomplices']:
-        if accomplice['asn'] in asns:
-            asn = accomplice.pop('asn')
-            results[asn]['m2c_data'].append(accomplice)
-    for asn, result in results.items():
-        result['m2c'] = _calculate_weighted_duration(result['m2c_data'])
+    Metric whose value is calculated by its data source. The routed record
+    of an ASN is a {'value': ..., 'data': ...} dictionary.
 
+    """
+    def __init__(self, name, source, stream, default=None):
+        super().__init__(name, source, stream)
+        self.default = default
+
+    def add_data(self, data, record):
+        return record
+
+    def calculate(self, data):
+        if not data:
+            return self.default
+        return data['value']
+
+    def get_stored_data(self, data):
+        if not data:
+            return []
+        return data['data']
+
+
+class RIPEstatMetric(Metric):
+    """
+    Metric based on a single check of the RIPEstat results.
 
-def _update_results_m3(asns, results, cidr_results):
     """
-    Calculate metric m3 and also attach the appropriate data.
+    def __init__(self, name, check):
+        super().__init__(name, 'ripestat', None)
+        self.check = check
+
+    def add_data(self, data, record):
+        return record[self.check]
+
+
+class M6Metric(RIPEstatMetric):
+    """
+    m6; registered imports and exports.
+
+    """
+    def calculate(self, data):
+        if not data:
+            return None
+        has_imports = data['has_imports']
+        has_exports = data['has_exports']
+        if has_imports is None or has_exports is None:
+            return None
+        return bool(has_imports and has_exports)
+
+
+class M7irrMetric(RIPEstatMetric):
+    """
+    m7irr; ratio of the registered routes.
+
+    """
+    def calculate(self, data):
+        if not data:
+            return None
+        total_routes_num = data['total_routes_num']
+        unregistered_routes_num = data['unregistered_routes_num']
+        if unregistered_routes_num is None or total_routes_num is None:
+            return None
+        if total_routes_num == 0:
+            if unregistered_routes_num:
+                return 0.0
+            return 1.0
+        return 1 - unregistered_routes_num / total_routes_num
+
+
+class M8Metric(RIPEstatMetric):
+    """
+    m8; registered contact information.
+
+    """
+    def calculate(self, data):
+        if not data:
+            return None
+        return data['has_contact_info']
+
+
+def _route_bgp_stream(asns, bgp_stream_results, stream):
+    """
+    Route the culprits/accomplices of an event type to their ASNs.
+
+    The data of a culprit/accomplice are only created for the given ASNs.
+
+    """
+    event_type, role = stream
+    events = bgp_stream_results[event_type]['events']
+    for event_index, asn, weight in bgp_stream_results[event_type][role]:
+        if asn in asns:
+            yield asn, events[event_index].as_dict(weight)
+
+
+def _route_cidr(asns, cidr_results, stream):
+    """
+    Route the culprits of a CIDR report check to their ASNs.
 
     Because data is gathered daily from CIDR report the minimum duration of an
     incident is 1 day.
 
     """
-    logger.info("Calculating m3")
-    for asn, prefixes in cidr_results['bogon_prefixes']['culprits'].items():
+    check, role = stream
+    for asn, records in cidr_results[check][role].items():
         if asn in asns:
-            results[asn]['m3_data'].extend(prefixes)
-    for asn, result in results.items():
-        result['m3'] = _calculate_weighted_duration(result['m3_data'])
+            for record in records:
+                yield asn, record
 
 
-def _update_results_m6_m7irr_m8(asns, results, ripestat_results):
+def _route_cidr_db(asns, cidr_db_results, stream):
+    """
+    Route the precomputed culprits of a CIDR report check to their ASNs.
+
     """
-    Calculate metrics m6, m7irr and m8 and also attach the appropriate data.
+    check, role = stream
+    for asn, record in cidr_db_results[check][role].items():
+        if asn in asns:
+            yield asn, record
+
 
-    Because the same data source is used for these metrics they are all
-    calculated together for efficiency.
+def _route_ripestat(asns, ripestat_results, stream):
+    """
+    Route the RIPEstat results to their ASNs.
 
     """
-    logger.info("Calculating m6 / m7irr / m8")
     for asn, data in ripestat_results.items():
-        # m6
-        m6_data = data['imports_exports']
-        results[asn]['m6_data'] = m6_data
-        has_imports = m6_data['has_imports']
-        has_exports = m6_data['has_exports']
-        if has_imports is not None and has_exports is not None:
-            if not (has_imports and has_exports):
-                results[asn]['m6'] = False
-            else:
-                results[asn]['m6'] = True
-
-        # m7irr
-        m7irr_data = data['unregistered_routes']
-        results[asn]['m7irr_data'] = m7irr_data
-        total_routes_num = m7irr_data['total_routes_num']
-        unregistered_routes_num = m7irr_data['unregistered_routes_num']
-        if (unregistered_routes_num is not None
-                and total_routes_num is not None):
-            if total_routes_num == 0:
-                if unregistered_routes_num:
-                    results[asn]['m7irr'] = 0.0
-                else:
-                    results[asn]['m7irr'] = 1.0
-            else:
-                results[asn]['m7irr'] = (
-                    (1 - unregistered_routes_num / total_routes_num))
-
-        # m8
-        m8_data = data['contact_info']
-        results[asn]['m8_data'] = m8_data
-        results[asn]['m8'] = m8_data['has_contact_info']
+        if asn in asns:
+            yield asn, data
+
+
+# Functions yielding (asn, record) pairs from a data source's results.
+ROUTERS = {
+    'bgp_stream': _route_bgp_stream,
+    'cidr': _route_cidr,
+    'cidr_db': _route_cidr_db,
+    'ripestat': _route_ripestat,
+}
+
+# Registered metrics in the order they are calculated.
+METRICS = OrderedDict()
+
+
+def register_metric(metric):
+    """
+    Register a metric to be calculated by `get_results_per_asn`.
+
+    """
+    METRICS[metric.name] = metric
+    return metric
+
+
+register_metric(WeightedDurationMetric('m1', 'bgp_stream',
+                                       ('bgp_leak', 'culprits')))
+register_metric(WeightedDurationMetric('m1c', 'bgp_stream',
+                                       ('bgp_leak', 'accomplices')))
+register_metric(WeightedDurationMetric('m2', 'bgp_stream',
+                                       ('bgp_hijack', 'culprits')))
+register_metric(WeightedDurationMetric('m2c', 'bgp_stream',
+                                       ('bgp_hijack', 'accomplices')))
+register_metric(WeightedDurationMetric('m3', 'cidr',
+                                       ('bogon_prefixes', 'culprits')))
+register_metric(M6Metric('m6', 'imports_exports'))
+register_metric(M7irrMetric('m7irr', 'unregistered_routes'))
+register_metric(M8Metric('m8', 'contact_info'))
+
+
+def _dispatch(asns, results, sources, metrics):
+    """
+    Route the records of every data source stream to the ASN buckets in a
+    single pass per stream. Metrics sharing a stream share the pass.
+
+    """
+    streams = OrderedDict()
+    for metric in metrics:
+        streams.setdefault((metric.source, metric.stream), []).append(metric)
+
+    for (source, stream), stream_metrics in streams.items():
+        if sources.get(source) is None:
+            logger.warning("No results for data source '{}'".format(source))
+            continue
+        for asn, record in ROUTERS[source](asns, sources[source], stream):
+            bucket = results[asn]
+            for metric in stream_metrics:
+                bucket[metric.data_key] = metric.add_data(
+                    bucket[metric.data_key], record)
+
+
+def _calculate(results, metrics):
+    """
+    Calculate all the metrics for all the ASN buckets. Metrics of the same
+    class are calculated together in one batch.
+
+    """
+    batches = OrderedDict()
+    for asn, bucket in results.items():
+        for metric in metrics:
+            batches.setdefault(type(metric), []).append(
+                (asn, metric, bucket[metric.data_key]))
+
+    for metric_class, batch in batches.items():
+        values, stored_data = metric_class.calculate_and_store_batch(
+            [(metric, data) for _, metric, data in batch])
+        for (asn, metric, _), value, data in zip(batch, values, stored_data):
+            results[asn][metric.name] = value
+            results[asn][metric.data_key] = data
+
+
+def _init_worker(scoring, storage):
+    """
+    Apply the scoring settings and the data storage mode of the parent
+    process in a worker process. Workers that are not forked (e.g. with the
+    'forkserver' or 'spawn' start methods) would otherwise use the ones of
+    `manrs.settings`.
+
+    """
+    globals().update(scoring)
+    settings.DURATION_DATA_STORAGE = storage
+
+
+def _calculate_shard(shard, metrics):
+    """
+    Calculate the metrics for a shard of ASN data ({asn: [data per metric]})
+    and return {asn: ([value per metric], [stored data per metric])}. Meant to
+    be run in a worker process; only the metrics' data are sent to it and
+    only their results are sent back.
+
+    """
+    results = {}
+    for asn, data in shard.items():
+        results[asn] = dict(zip((metric.data_key for metric in metrics),
+                                data))
+    _calculate(results, metrics)
+    return {
+        asn: ([bucket[metric.name] for metric in metrics],
+              [bucket[metric.data_key] for metric in metrics])
+        for asn, bucket in results.items()
+    }
+
+
+def _calculate_sharded(results, metrics, workers):
+    """
+    Partition the ASN buckets into shards and calculate the metrics for each
+    shard in a separate process. The ASNs are distributed over the shards by
+    their amount of data so that the shards are balanced.
+
+    """
+    def _load(asn):
+        return sum(len(results[asn][metric.data_key])
+                   for metric in metrics
+                   if isinstance(results[asn][metric.data_key], list))
+
+    shards = [{} for _ in range(workers)]
+    for i, asn in enumerate(sorted(results, key=_load, reverse=True)):
+        shards[i % workers][asn] = [results[asn][metric.data_key]
+                                    for metric in metrics]
+
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(get_scoring_settings(),
+                      settings.DURATION_DATA_STORAGE)) as executor:
+        futures = [executor.submit(_calculate_shard, shard, metrics)
+                   for shard in shards if shard]
+        for future in futures:
+            for asn, (values, stored_data) in future.result().items():
+                for metric, value, data in zip(metrics, values, stored_data):
+                    results[asn][metric.name] = value
+                    results[asn][metric.data_key] = data
 
 
 def get_results_per_asn(asns,
                         bgp_stream_results,
                         cidr_results,
-                        ripestat_results):
+                        ripestat_results,
+                        metrics=None,
+                        workers=1,
+                        **other_results):
     """
     Based on the gathered data calculate metrics and also return only the
     data that were essential in calculating the metrics.
 
+    By default all the registered metrics are calculated; a subset can be
+    given with `metrics`. With more than one `workers` the ASNs are sharded
+    and the metrics are calculated in a pool of processes.
+
+    Results of additional data sources, needed by additionally registered
+    metrics, can be given as keyword arguments named after the source.
+
     """
+    sources = {
+        'bgp_stream': bgp_stream_results,
+        'cidr': cidr_results,
+        'ripestat': ripestat_results,
+    }
+    sources.update(other_results)
+    if metrics is None:
+        metrics = list(METRICS.values())
+
     results = {}
     for asn in asns:
-        results[asn] = {
-            'm1': 0,
-            'm1c': 0,
-            'm2': 0,
-            'm2c': 0,
-            'm3': 0,
-            'm6': None,
-            'm7irr': None,
-            'm8': None,
-            'm1_data': [],
-            'm1c_data': [],
-            'm2_data': [],
-            'm2c_data': [],
-            'm3_data': [],
-            'm6_data': [],
-            'm7irr_data': [],
-            'm8_data': [],
-        }
-    _update_results_m1(asns, results, bgp_stream_results)
-    _update_results_m1c(asns, results, bgp_stream_results)
-    _update_results_m2(asns, results, bgp_stream_results)
-    _update_results_m2c(asns, results, bgp_stream_results)
-    _update_results_m3(asns, results, cidr_results)
-    _update_results_m6_m7irr_m8(asns, results, ripestat_results)
+        results[asn] = {}
+        for metric in metrics:
+            results[asn][metric.name] = metric.default
+        for metric in metrics:
+            results[asn][metric.data_key] = metric.new_data()
+
+    logger.info("Dispatching data for {}".format(
+        ", ".join(metric.name for metric in metrics)))
+    _dispatch(asns, results, sources, metrics)
+    logger.info("Calculating {}".format(
+        ", ".join(metric.name for metric in metrics)))
+    if workers > 1:
+        _calculate_sharded(results, metrics, workers)
+    else:
+        _calculate(results, metrics)
     return results
@@ -5,7 +5,8 @@ import enum
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, ForeignKey
-from sqlalchemy import Boolean, Integer, String, DateTime, Enum, Float
+from sqlalchemy import Boolean, Integer, String, Date, DateTime, Enum, Float
+from sqlalchemy import Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import ForeignKeyConstraint
 from sqlalchemy.dialects.postgresql import JSONB
@@ -124,3 +125,19 @@ class GlobalStats(Base):
             'm7rpkin': ['mean', 'median'],
             'm8': ['mode'],
         }
+
+
+class BogonPrefix(Base):
+    """
+    Daily snapshots of the bogon prefix advertisements from the CIDR report.
+
+    """
+    __tablename__ = 'bogon_prefixes'
+
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, index=True)
+    prefix = Column(String)
+    asn = Column(Integer)
+    description = Column(String)
+
+    __table_args__ = (Index('ix_bogon_prefixes_asn_date', 'asn', 'date'),)
@@ -0,0 +1,88 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+
+class PrefixTrie(object):
+    """
+    Binary radix trie over the prefixes of a single address family.
+
+    Nodes are integers indexing flat arrays of children and terminal flags,
+    so the trie holds no per-node objects. A node only exists if some
+    inserted prefix passes through it.
+
+    """
+    def __init__(self, bits):
+        self.bits = bits
+        self._zero = [0]
+        self._one = [0]
+        self._terminal = bytearray(1)
+
+    def _new_node(self):
+        self._zero.append(0)
+        self._one.append(0)
+        self._terminal.append(0)
+        return len(self._terminal) - 1
+
+    def add(self, address, length):
+        """
+        Insert the prefix given as its network address (int) and length.
+
+        """
+        node = 0
+        for depth in range(length):
+            children = (self._one if (address >> (self.bits - 1 - depth)) & 1
+                        else self._zero)
+            child = children[node]
+            if not child:
+                child = self._new_node()
+                children[node] = child
+            node = child
+        self._terminal[node] = 1
+
+    def overlaps_other(self, address, length):
+        """
+        Return True if another prefix of the trie covers the given prefix
+        (less specific) or is covered by it (more specific).
+
+        Runs in O(length).
+
+        """
+        node = 0
+        for depth in range(length):
+            if self._terminal[node]:
+                return True
+            node = (self._one if (address >> (self.bits - 1 - depth)) & 1
+                    else self._zero)[node]
+            if not node:
+                return False
+        # Any node below exists only because of a more specific prefix.
+        return bool(self._zero[node] or self._one[node])
+
+
+class PrefixIndex(object):
+    """
+    Prefix coverage index with a `PrefixTrie` per IP version.
+
+    """
+    def __init__(self, networks=()):
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """
+        Insert an `ipaddress` network.
+
+        """
+        self._tries[network.version].add(int(network.network_address),
+                                         network.prefixlen)
+
+    def overlaps_other(self, network):
+        """
+        Return True if an indexed network of the same version other than
+        the given `ipaddress` network overlaps it, i.e. the same as
+        `any(x.overlaps(network) and x != network for x in networks)`.
+
+        """
+        return self._tries[network.version].overlaps_other(
+            int(network.network_address), network.prefixlen)
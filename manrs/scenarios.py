@@ -0,0 +1,153 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from collections import OrderedDict
+import csv
+from itertools import product
+import logging
+
+from manrs import settings
+from manrs.metrics import (
+    METRICS, WeightedDurationMetric, _dispatch, _flatten_incidents,
+    _score_incidents, get_scoring_settings)
+from manrs.util import WeightGeneratorFactory
+
+logger = logging.getLogger(__name__)
+
+SCORING_SETTINGS = (
+    'INCIDENT_ACCEPTABLE_DURATION',
+    'INCIDENT_ACCEPTABLE_SCORE',
+    'INCIDENT_TOLERANT_DURATION',
+    'INCIDENT_TOLERANT_SCORE',
+    'INCIDENT_INTOLERANT_PENALTY',
+)
+
+WEIGHT_GENERATOR_SETTINGS = (
+    'WEIGHT_GENERATOR_TYPE',
+    'WEIGHT_GENERATOR_START',
+    'WEIGHT_GENERATOR_INTERVAL',
+    'WEIGHT_GENERATOR_END',
+)
+
+
+class ScenarioError(Exception):
+    """
+    General error for scenarios.
+
+    """
+    pass
+
+
+def get_scenarios(grid):
+    """
+    Expand a grid of settings ({setting: [values]}) to a list of scenarios.
+
+    Every scenario is a dictionary with a value for each of the
+    `SCORING_SETTINGS` and `WEIGHT_GENERATOR_SETTINGS`. Settings that are not
+    part of the grid keep their value from `manrs.settings`. As in
+    `manrs.settings`, WEIGHT_GENERATOR_START follows
+    WEIGHT_GENERATOR_INTERVAL unless it is part of the grid.
+
+    """
+    unknown = set(grid) - set(SCORING_SETTINGS + WEIGHT_GENERATOR_SETTINGS)
+    if unknown:
+        raise ScenarioError("Unknown settings in the grid: {}".format(
+            sorted(unknown)))
+    not_lists = [name for name, values in grid.items()
+                 if not isinstance(values, list)]
+    if not_lists:
+        raise ScenarioError("The values of the settings in the grid need to "
+                            "be lists: {}".format(sorted(not_lists)))
+
+    defaults = get_scoring_settings()
+    for name in WEIGHT_GENERATOR_SETTINGS:
+        defaults[name] = getattr(settings, name)
+
+    names = sorted(grid)
+    scenarios = []
+    for values in product(*(grid[name] for name in names)):
+        scenario = dict(defaults)
+        scenario.update(zip(names, values))
+        if 'WEIGHT_GENERATOR_START' not in grid:
+            scenario['WEIGHT_GENERATOR_START'] = (
+                1.0 * scenario['WEIGHT_GENERATOR_INTERVAL'])
+        scenarios.append(scenario)
+    return scenarios
+
+
+def sweep(asns, bgp_stream, cidr_results, scenarios):
+    """
+    Calculate the duration based metrics (m1, m1c, m2, m2c and m3) for every
+    scenario.
+
+    `bgp_stream` is a `BGPStreamSourceData` that has already fetched its data
+    so that the accomplices' weights can be generated for each scenario
+    without fetching again. The incidents are merged once per set of weight
+    generator settings and then scored for each scenario sharing them.
+
+    Returns a list with the results ({asn: {metric: score}}) of each
+    scenario.
+
+    """
+    metrics = [metric for metric in METRICS.values()
+               if isinstance(metric, WeightedDurationMetric)]
+
+    weight_groups = OrderedDict()
+    for index, scenario in enumerate(scenarios):
+        key = tuple(scenario[name] for name in WEIGHT_GENERATOR_SETTINGS)
+        weight_groups.setdefault(key, []).append(index)
+
+    all_results = [None] * len(scenarios)
+    for (gen_type, start, step, end), indices in weight_groups.items():
+        logger.info("Merging incidents for weight generator settings "
+                    "({}, {}, {}, {})".format(gen_type, start, step, end))
+        weight_generator_factory = WeightGeneratorFactory(
+            gen_type, start, step, end)
+        sources = {
+            'bgp_stream': bgp_stream.get_results(weight_generator_factory),
+            'cidr': cidr_results,
+        }
+        buckets = {}
+        for asn in asns:
+            buckets[asn] = {}
+            for metric in metrics:
+                buckets[asn][metric.data_key] = metric.new_data()
+        _dispatch(asns, buckets, sources, metrics)
+
+        owners = [(asn, metric) for asn in buckets for metric in metrics]
+        incidents = _flatten_incidents(
+            [buckets[asn][metric.data_key] for asn, metric in owners])
+
+        for index in indices:
+            logger.info("Scoring scenario {}".format(index))
+            scoring = {name: scenarios[index][name]
+                       for name in SCORING_SETTINGS}
+            scores = _score_incidents(*incidents, len(owners),
+                                      scoring=scoring)
+            results = {asn: {} for asn in buckets}
+            for (asn, metric), score in zip(owners, scores.tolist()):
+                results[asn][metric.name] = score
+            all_results[index] = results
+    return all_results
+
+
+def write_table(filename, grid, scenarios, all_results):
+    """
+    Write the results of all the scenarios in a CSV comparison table with a
+    row per scenario and ASN. Only the settings that are part of the grid
+    are written.
+
+    """
+    names = sorted(grid)
+    metrics = [metric.name for metric in METRICS.values()
+               if isinstance(metric, WeightedDurationMetric)]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['scenario'] + names + ['asn'] + metrics)
+        for index, (scenario, results) in enumerate(
+                zip(scenarios, all_results)):
+            settings_values = [scenario[name] for name in names]
+            for asn in sorted(results):
+                writer.writerow(
+                    [index] + settings_values + [asn]
+                    + [results[asn][metric] for metric in metrics])
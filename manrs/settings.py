@@ -18,6 +18,56 @@ WEIGHT_GENERATOR_START = 1.0 * WEIGHT_GENERATOR_INTERVAL
 WEIGHT_GENERATOR_END = 0.01
 
 
+#-- Settings for the locally stored BGPStream events.
+# If set, BGPStream events are kept in this SQLite file and only the days
+# since the last sync are downloaded.
+BGPSTREAM_STORE_FILE = ""
+
+# If set, BGPStream events are read from the local archive in this directory
+# (see archive_bgpstream.py) instead of the live feed.
+BGPSTREAM_ARCHIVE_DIRECTORY = ""
+
+
+#-- Settings for the RIPEstat request limits.
+# The number of concurrent requests adapts to RIPEstat's latency and errors
+# within these bounds.
+RIPESTAT_MIN_CONCURRENCY = 1
+RIPESTAT_MAX_CONCURRENCY = 32
+# Maximum requests per second (0 for no limit).
+RIPESTAT_REQUESTS_PER_SECOND = 20
+# Fraction of the requests that may fail (after their retries) before the
+# data are considered incomplete and the run fails.
+RIPESTAT_MAX_FAILURE_RATIO = 0.01
+# If set, the results fetched so far are kept in this file until all the
+# data are gathered, so that a failed run is resumed where it stopped (e.g.
+# "ripestat_checkpoint.jsonl"). Only the results of the run's ASNs and data
+# calls are used; results older than the data call's RIPESTAT_CACHE_TTL are
+# fetched again.
+RIPESTAT_CHECKPOINT_FILE = ""
+
+
+#-- Settings for the RIPEstat response cache.
+# If set, RIPEstat responses are cached in this SQLite file.
+RIPESTAT_CACHE_FILE = ""
+# Seconds a cached response is used without asking RIPEstat again, per data
+# call.
+RIPESTAT_CACHE_TTL = {
+    'as_routing_consistency': 86400 * 3,  # 3 days
+    'whois': 86400 * 7,  # 1 week
+}
+
+
+#-- Settings for the locally stored RPSL database dumps.
+# If set, m6 and m8 are calculated from these (gzip compressed) dumps, e.g.
+# the RIRs' split aut-num, role and person dumps, instead of RIPEstat.
+RPSL_DUMP_FILES = []
+# If both are set, m7irr is calculated from these (gzip compressed) IRR
+# route/route6 object dumps and the routing table snapshot ('prefix origin'
+# or CAIDA prefix-to-AS lines) instead of RIPEstat.
+IRR_ROUTE_DUMP_FILES = []
+RIB_SNAPSHOT_FILE = ""
+
+
 #-- Settings for the CIDR report locally stored data.
 CIDR_DATA_DIRECTORY = "cidr/data"
 BOGON_PREFIX_FILENAME = "bogon_prefixes.txt"
@@ -30,3 +80,11 @@ INCIDENT_TOLERANT_DURATION = 86400  # 24 hours
 INCIDENT_TOLERANT_SCORE = 1.0
 # available values: (linear, exponential)
 INCIDENT_INTOLERANT_PENALTY = "linear"
+
+
+#-- Settings for storing the data of the duration based metrics (m1-m3).
+# available values: (events, incidents)
+# - events: every culprit/accomplice event is stored;
+# - incidents: the merged incidents are stored, each referencing the
+#   BGPStream event ids (or prefixes for CIDR report data) of its events.
+DURATION_DATA_STORAGE = "events"
@@ -1,9 +1,18 @@
 # Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
 # SPDX-License-Identifier: AGPL-3.0-only
 
+from datetime import datetime
+from functools import lru_cache
+import logging
+
 import requests
 from bs4 import BeautifulSoup
 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y%m%d"
+NULL_TIMESTAMP = "0000-00-00 00:00:00"
+LOGGING_FORMAT = "%(asctime)s %(levelname)-8s %(name)-30.30s %(message)s"
+
 
 def get_manrs_participants():
     """
@@ -61,6 +70,52 @@ def get_manrs_participants():
     return participants
 
 
+def get_asns():
+    """
+    Get the ASNs of the MANRS participants.
+
+    """
+    logging.info("Getting participants")
+    participants = get_manrs_participants()
+
+    asns = set()
+    for participant in participants:
+        for asn in participant['asns']:
+            asns.add(asn)
+    return asns
+
+
+def get_month(day):
+    """
+    Return the start and end of the month the given day is in.
+
+    """
+    month_start = datetime(year=day.year, month=day.month, day=1)
+    if day.month == 12:
+        month_end = datetime(year=day.year + 1, month=1, day=1)
+    else:
+        month_end = datetime(year=day.year, month=day.month + 1, day=1)
+    return month_start, month_end
+
+
+def configure_logging(verbosity, level=logging.INFO, format=LOGGING_FORMAT,
+                      filename=""):
+    """
+    Configure logging.
+
+    Command line option for level has precedence over the given level.
+    Without a filename the log is written to stderr.
+
+    """
+    if verbosity:
+        level = getattr(logging, verbosity.upper())
+
+    if filename:
+        logging.basicConfig(level=level, format=format, filename=filename)
+    else:
+        logging.basicConfig(level=level, format=format)
+
+
 class GeometricGenerator:
     """
     Custom generator to return numbers in a confined geometric progression
@@ -89,6 +144,37 @@ class GeometricGenerator:
         self.value = self.start
 
 
+class HopWeightTable:
+    """
+    Immutable table of the weights a `GeometricGenerator` yields, indexed by
+    hop distance. Distances past the end of the table (where the progression
+    has settled) get the last weight.
+
+    """
+    __slots__ = ('_weights',)
+
+    # Upper bound for progressions that never settle, e.g. negative steps.
+    MAX_SIZE = 2048
+
+    def __init__(self, generator):
+        weights = [next(generator)]
+        while len(weights) < self.MAX_SIZE:
+            weight = next(generator)
+            if weight == weights[-1]:
+                break
+            weights.append(weight)
+        object.__setattr__(self, '_weights', tuple(weights))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("HopWeightTable is immutable")
+
+    def __getitem__(self, distance):
+        return self._weights[min(distance, len(self._weights) - 1)]
+
+    def __len__(self):
+        return len(self._weights)
+
+
 class WeightGeneratorFactoryError(Exception):
     """
     Generic exception for WeightGeneratorFactory.
@@ -107,6 +193,17 @@ class WeightGeneratorFactory:
         self.start = start
         self.step = step
         self.end = end
+        self._weights = None
+
+    def get_weights(self):
+        """
+        Get the precomputed `HopWeightTable` of the generator. It is
+        computed once and shared by every caller.
+
+        """
+        if self._weights is None:
+            self._weights = HopWeightTable(self.get())
+        return self._weights
 
     def get(self):
         if self.gen_type == "geometric":
@@ -129,3 +226,41 @@ def tries(num_tries, logger, action_name):
         num_tries -= 1
         logger.warning("Have to retry for [{}]. Tries left: {}"
                        "".format(action_name, num_tries))
+
+
+def parse_timestamp(string):
+    """
+    Fast parser for timestamps in the fixed TIMESTAMP_FORMAT.
+
+    Returns None for the NULL_TIMESTAMP sentinel. Strings that do not have
+    the fixed layout fall back to strptime and raise ValueError the same
+    way.
+
+    """
+    if string == NULL_TIMESTAMP:
+        return None
+    if (len(string) != 19 or string[4] != "-" or string[7] != "-"
+            or string[10] != " " or string[13] != ":" or string[16] != ":"):
+        return datetime.strptime(string, TIMESTAMP_FORMAT)
+    year, month, day = string[0:4], string[5:7], string[8:10]
+    hour, minute, second = string[11:13], string[14:16], string[17:19]
+    # Signed or spaced fields are accepted by int() but not by strptime.
+    if (year.isdigit() and month.isdigit() and day.isdigit()
+            and hour.isdigit() and minute.isdigit() and second.isdigit()):
+        try:
+            return datetime(int(year), int(month), int(day), int(hour),
+                            int(minute), int(second))
+        except ValueError:
+            pass
+    return datetime.strptime(string, TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(string):
+    """
+    Fast memoized parser for dates in the fixed DATE_FORMAT.
+
+    """
+    if len(string) != 8 or not string.isdigit():
+        return datetime.strptime(string, DATE_FORMAT)
+    return datetime(int(string[0:4]), int(string[4:6]), int(string[6:8]))
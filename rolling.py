@@ -0,0 +1,122 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import argparse
+import csv
+from datetime import timedelta
+import logging
+
+from manrs import settings
+from manrs.data_sources.bgpstream import get_bgp_stream_source
+from manrs.data_sources.cidr import CIDRSourceData
+from manrs.intervals import IncidentIndex
+from manrs.metrics import METRICS, WeightedDurationMetric
+from manrs.util import (
+    WeightGeneratorFactory, configure_logging, get_asns, parse_date)
+
+
+def parse_cmd():
+    """
+    Parse command line arguments.
+
+    """
+    def parse_date_arg(string):
+        """
+        Parse date in YYYYmmdd format.
+
+        """
+        try:
+            return parse_date(string)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Invalid date. Date needs to be in YYYYmmdd format.")
+
+    parser = argparse.ArgumentParser(
+        description="Produce daily time series of the duration based "
+                    "metrics over a rolling window.")
+    parser.add_argument(
+        "-s", "--start-date", type=parse_date_arg, required=True,
+        help="Start date of the indexed period in YYYYmmdd format.")
+    parser.add_argument(
+        "-e", "--end-date", type=parse_date_arg, required=True,
+        help="End date of the indexed period in YYYYmmdd format.")
+    parser.add_argument(
+        "-w", "--window", type=int, default=30,
+        help="Size of the rolling window in days (default 30).")
+    parser.add_argument(
+        "-o", "--output", default="rolling.csv",
+        help="CSV file for the time series (default rolling.csv).")
+    parser.add_argument("-v", "--verbosity",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Set the logging level: {debug, info, warning(default), "
+        "error, critical}")
+
+    args = parser.parse_args()
+    if not args.start_date < args.end_date:
+        raise argparse.ArgumentTypeError(
+            "start_date needs to be earlier than end_date!")
+    if args.window < 1:
+        raise argparse.ArgumentTypeError(
+            "The window needs to be at least one day!")
+    return args
+
+
+def write_time_series(filename, index, period_start, period_end, window):
+    """
+    Write the scores of every ASN for each day's window ending on that day
+    within the indexed period.
+
+    """
+    metrics = [metric.name for metric in METRICS.values()
+               if isinstance(metric, WeightedDurationMetric)]
+    window = timedelta(days=window)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['window_start', 'window_end', 'asn'] + metrics)
+        window_end = period_start + window
+        while window_end <= period_end:
+            window_start = window_end - window
+            results = index.get_scores(window_start, window_end)
+            for asn in sorted(results):
+                writer.writerow(
+                    [window_start.date(), window_end.date(), asn]
+                    + [results[asn][metric] for metric in metrics])
+            window_end += timedelta(days=1)
+
+
+def main():
+    """
+    Gather the data of the whole period once, index the incidents and write
+    the rolling window time series.
+
+    """
+    args = parse_cmd()
+    configure_logging(args.verbosity)
+    weight_generator_factory = WeightGeneratorFactory(
+        settings.WEIGHT_GENERATOR_TYPE, settings.WEIGHT_GENERATOR_START,
+        settings.WEIGHT_GENERATOR_INTERVAL, settings.WEIGHT_GENERATOR_END)
+
+    asns = get_asns()
+    bgp_stream = get_bgp_stream_source(args.start_date, args.end_date)
+    cidr = CIDRSourceData(settings.CIDR_DATA_DIRECTORY,
+                          period_start=args.start_date,
+                          period_end=args.end_date)
+    bgp_stream.fetch_data()
+    bgp_stream_results = bgp_stream.get_results(weight_generator_factory)
+    cidr.fetch_data()
+    cidr_results = cidr.get_results()
+
+    logging.info("Indexing incidents")
+    index = IncidentIndex.from_results(asns, bgp_stream_results, cidr_results)
+    logging.info("Writing time series to '{}'".format(args.output))
+    write_time_series(args.output, index, args.start_date, args.end_date,
+                      args.window)
+    logging.info("Finished")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logging.critical("Execution failed!")
+        logging.critical("{}: {}".format(e.__class__.__name__, e))
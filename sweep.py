@@ -0,0 +1,104 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+
+from manrs import settings
+from manrs.data_sources.bgpstream import get_bgp_stream_source
+from manrs.data_sources.cidr import CIDRSourceData
+from manrs.scenarios import get_scenarios, sweep, write_table
+from manrs.util import configure_logging, get_asns, get_month, parse_date
+
+
+def parse_cmd():
+    """
+    Parse command line arguments.
+
+    """
+    def parse_date_arg(string):
+        """
+        Parse date in YYYYmmdd format.
+
+        """
+        try:
+            return parse_date(string)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Invalid date. Date needs to be in YYYYmmdd format.")
+
+    parser = argparse.ArgumentParser(
+        description="Score the incidents of a period under a grid of "
+                    "incident scoring and weight generator settings.")
+    parser.add_argument(
+        "-s", "--start-date", type=parse_date_arg,
+        help="Period start date in YYYYmmdd format. If not specified the "
+             "previous month is picked as the testing period.")
+    parser.add_argument(
+        "-e", "--end-date", type=parse_date_arg,
+        help="Period end date in YYYYmmdd format. If not specified the "
+             "previous month is picked as the testing period.")
+    parser.add_argument(
+        "-g", "--grid", required=True,
+        help="JSON file mapping settings' names (INCIDENT_* and "
+             "WEIGHT_GENERATOR_*) to lists of values.")
+    parser.add_argument(
+        "-o", "--output", default="sweep.csv",
+        help="CSV file for the comparison table (default sweep.csv).")
+    parser.add_argument("-v", "--verbosity",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Set the logging level: {debug, info, warning(default), "
+        "error, critical}")
+
+    args = parser.parse_args()
+    if not (args.start_date or args.end_date):
+        now = datetime.now()
+        args.start_date, args.end_date = get_month(
+            datetime(year=now.year, month=now.month, day=1)
+            - timedelta(days=1))
+    elif not (args.start_date and args.end_date):
+        raise argparse.ArgumentTypeError(
+            "When specifiying start and end dates both need to be "
+            "specified!")
+    elif not args.start_date < args.end_date:
+        raise argparse.ArgumentTypeError(
+            "start_date needs to be earlier than end_date!")
+    return args
+
+
+def main():
+    """
+    Gather the data of the period once and write the duration based metrics
+    for every scenario of the grid in a comparison table.
+
+    """
+    args = parse_cmd()
+    configure_logging(args.verbosity)
+    with open(args.grid, 'r') as f:
+        grid = json.load(f)
+    scenarios = get_scenarios(grid)
+    logging.info("{} scenarios to sweep".format(len(scenarios)))
+
+    asns = get_asns()
+    bgp_stream = get_bgp_stream_source(args.start_date, args.end_date)
+    cidr = CIDRSourceData(settings.CIDR_DATA_DIRECTORY,
+                          period_start=args.start_date,
+                          period_end=args.end_date)
+    bgp_stream.fetch_data()
+    cidr.fetch_data()
+    cidr_results = cidr.get_results()
+
+    all_results = sweep(asns, bgp_stream, cidr_results, scenarios)
+    logging.info("Writing comparison table to '{}'".format(args.output))
+    write_table(args.output, grid, scenarios, all_results)
+    logging.info("Finished")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logging.critical("Execution failed!")
+        logging.critical("{}: {}".format(e.__class__.__name__, e))
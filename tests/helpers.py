@@ -0,0 +1,117 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from datetime import datetime, timedelta
+import copy
+
+from manrs import metrics
+from manrs.data_sources.bgpstream import BGPStreamSourceData
+from manrs.util import (
+    NULL_TIMESTAMP, TIMESTAMP_FORMAT, WeightGeneratorFactory)
+
+PERIOD_START = datetime(2018, 5, 1)
+PERIOD_END = datetime(2018, 5, 11)
+ASNS = set(range(1, 21))
+NO_CIDR_RESULTS = {'bogon_prefixes': {'culprits': {}}}
+DURATION_METRICS = [metric for metric in metrics.METRICS.values()
+                    if isinstance(metric, metrics.WeightedDurationMetric)]
+
+
+def get_weight_generator_factory():
+    return WeightGeneratorFactory("geometric", 0.5, 0.5, 0.01)
+
+
+def raw_hijack(event_id, start_time, end_time, path):
+    """
+    Return a raw 'bgp_hijack' event of the live feed.
+
+    """
+    return {
+        'base_asn': '',
+        'base_asn_name': '',
+        'bgplay_json': '',
+        'end_time': end_time,
+        'event_id': str(event_id),
+        'event_type': 'bgp_hijack',
+        'hijack_announced_prefix': '10.0.{}.0/24'.format(event_id),
+        'hijack_as_path': " ".join(path),
+        'hijack_base_prefix': '',
+        'hijack_peer_count': 1,
+        'hijack_type': '',
+        'origin_asn': path[0],
+        'origin_asn_name': '',
+        'start_time': start_time,
+    }
+
+
+def raw_leak(event_id, start_time, end_time, path, leaker, leaked_to):
+    """
+    Return a raw 'bgp_leak' event of the live feed.
+
+    """
+    return {
+        'bgplay_json': '',
+        'end_time': end_time,
+        'event_id': str(event_id),
+        'event_type': 'bgp_leak',
+        'leak_as_path': " ".join(path),
+        'leak_peer_count': 1,
+        'leaked_prefix': '10.1.{}.0/24'.format(event_id),
+        'leaked_to': ",".join("{}=".format(asn) for asn in leaked_to),
+        'leaker_asn': leaker,
+        'leaker_asn_name': '',
+        'origin_asn': path[0],
+        'origin_asn_name': '',
+        'start_time': start_time,
+    }
+
+
+def random_raw_events(rng, num, leaks=False, ongoing=False):
+    """
+    Return raw events starting from three days before the period up to its
+    end and lasting from none to a few days, so that many of them overlap
+    or span multiple days. With 'leaks' half of them are leaks instead of
+    hijacks; with 'ongoing' some of them have no end time yet.
+
+    """
+    events = []
+    for event_id in range(num):
+        start = PERIOD_START + timedelta(minutes=rng.randint(
+            -3 * 24 * 60, int((PERIOD_END - PERIOD_START).total_seconds()
+                              // 60)))
+        end = start + timedelta(
+            minutes=rng.choice([0, 10, 30, 600, 3000, 6000]))
+        start_time = start.strftime(TIMESTAMP_FORMAT)
+        end_time = end.strftime(TIMESTAMP_FORMAT)
+        if ongoing and rng.random() < 0.1:
+            end_time = NULL_TIMESTAMP
+        path = [str(rng.randint(1, 20)) for _ in range(rng.randint(2, 6))]
+        if not leaks or rng.random() < 0.5:
+            events.append(raw_hijack(event_id, start_time, end_time, path))
+            continue
+        # The leaker needs a hop before it in the path (the first ASN is
+        # dropped as the reporter).
+        leaker = rng.choice(path[1:])
+        if path[1:].index(leaker) == 0:
+            path.insert(1, str(rng.randint(1, 20)))
+        leaked_to = [str(rng.randint(1, 20))
+                     for _ in range(rng.randint(1, 2))]
+        events.append(raw_leak(event_id, start_time, end_time, path, leaker,
+                               leaked_to))
+    return events
+
+
+def get_bgp_stream_source(raw_events, period_start=PERIOD_START,
+                          period_end=PERIOD_END):
+    """
+    Return a BGPStream data source for the period holding the given raw
+    events as if they were fetched.
+
+    """
+    source = BGPStreamSourceData(period_start, period_end)
+    source.data = source._elaborate_data({
+        'status': 1,
+        'error': 1,
+        'events': copy.deepcopy(raw_events),
+    })
+    return source
@@ -0,0 +1,159 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import copy
+import json
+import random
+
+from manrs import settings
+from manrs.data_sources.bgpstream import (
+    BGPStreamSourceData, HijackEvent, LeakEvent, _JSONStream)
+from manrs.util import WeightGeneratorFactory
+
+CHUNK_SIZES = (1, 2, 3, 5, 7, 15, 64, 4096)
+PERIOD_START = datetime(2018, 5, 1)
+PERIOD_END = datetime(2018, 5, 2)
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _parse(text, size):
+    """
+    Parse the text given in chunks of the given size into a dict, with the
+    elements of the `events` member collected into a list.
+
+    """
+    data = {}
+    for key, value in _JSONStream(_chunks(text, size)).members('events'):
+        data[key] = list(value) if key == 'events' else value
+    return data
+
+
+def _random_feed(rng):
+    events = []
+    for event_id in range(rng.randint(0, 20)):
+        events.append({
+            'event_id': event_id,
+            'score': rng.uniform(-1e3, 1e3),
+            'weight': rng.choice([1, 0.5, 0.25, 1e-7, -12.25, 3e21]),
+            'end_time': rng.choice([None, "2018-05-01T00:00:00"]),
+            'flags': [rng.choice([True, False]) for _ in range(3)],
+            'path': " ".join(str(rng.randint(1, 65535)) for _ in range(4)),
+        })
+    return {'status': rng.choice([-12.25, 0, 1e3]), 'events': events,
+            'size': rng.randint(-100, 100)}
+
+
+def test_numbers_cut_at_chunk_end():
+    text = '{"status": -12.25, "events": [1, 2.5e3, -0.125], "n": 10}'
+    for size in CHUNK_SIZES:
+        assert _parse(text, size) == json.loads(text), size
+
+
+def test_random_feeds():
+    rng = random.Random(0)
+    for _ in range(50):
+        feed = _random_feed(rng)
+        text = json.dumps(feed, indent=rng.choice([None, 1]))
+        for size in CHUNK_SIZES:
+            assert _parse(text, size) == json.loads(text), size
+
+
+def _hijack(event_id, start, end):
+    return {
+        'base_asn': '',
+        'base_asn_name': '',
+        'bgplay_json': '',
+        'end_time': end,
+        'event_id': str(event_id),
+        'event_type': 'bgp_hijack',
+        'hijack_announced_prefix': '10.0.0.0/24',
+        'hijack_as_path': "1 2 3",
+        'hijack_base_prefix': '',
+        'hijack_peer_count': 1,
+        'hijack_type': '',
+        'origin_asn': '1',
+        'origin_asn_name': '',
+        'start_time': start,
+    }
+
+
+def test_stream_matches_data():
+    rng = random.Random(0)
+    events = [
+        # Ongoing and finished events starting after the period's end.
+        _hijack(0, "2018-05-02 12:00:00", "0000-00-00 00:00:00"),
+        _hijack(1, "2018-05-02 12:00:00", "2018-05-02 13:00:00"),
+        {'event_id': '2', 'event_type': 'outage',
+         'start_time': "2018-05-01 12:00:00"},
+    ]
+    for event_id in range(3, 100):
+        start = PERIOD_START + timedelta(minutes=rng.randint(-3000, 3000))
+        end = rng.choice([
+            "0000-00-00 00:00:00",
+            (start + timedelta(minutes=rng.randint(0, 3000))).strftime(
+                "%Y-%m-%d %H:%M:%S")])
+        events.append(_hijack(event_id, start.strftime("%Y-%m-%d %H:%M:%S"),
+                              end))
+    feed = {'status': 1, 'error': 1, 'events': events}
+
+    expected = BGPStreamSourceData(PERIOD_START, PERIOD_END)._elaborate_data(
+        copy.deepcopy(feed))
+    assert all(event['start_time'] <= PERIOD_END
+               for event in expected['events'])
+    for size in CHUNK_SIZES:
+        source = BGPStreamSourceData(PERIOD_START, PERIOD_END)
+        data = source._elaborate_stream(_chunks(json.dumps(feed), size))
+        assert data == expected, size
+
+
+def _reference_path_hops(asns_in_path, reached_index, weight_generator):
+    """
+    The previous attribution with a weight generator per event, kept as the
+    reference for the precomputed hop weights.
+
+    """
+    unique_ordered_asns = OrderedDict()
+    for asn in reversed(asns_in_path[:reached_index]):
+        unique_ordered_asns[asn] = None
+    return [(int(asn), next(weight_generator))
+            for asn in unique_ordered_asns]
+
+
+def test_path_hops_match_generator(monkeypatch):
+    monkeypatch.setattr(settings, "ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE", False)
+    factory = WeightGeneratorFactory("geometric", 0.5, 0.5, 0.01)
+    rng = random.Random(0)
+    for event_id in range(2000):
+        path = [str(rng.randint(1, 12)) for _ in range(rng.randint(3, 16))]
+        hijack = _hijack(event_id, PERIOD_START, PERIOD_START)
+        hijack['hijack_as_path'] = " ".join(path)
+        asns_in_path = path[1:-1]
+        expected = [(int(asns_in_path[-1]), 1.0)] + _reference_path_hops(
+            asns_in_path, asns_in_path.index(asns_in_path[-1]),
+            factory.get())
+        event = HijackEvent(hijack, PERIOD_START, PERIOD_END, factory)
+        assert event.get_accomplices() == expected, path
+
+        # The leaker needs a preceding ASN in the path.
+        asns_in_path = path[1:]
+        leaker = rng.choice(asns_in_path[1:])
+        if asns_in_path.index(leaker) == 0:
+            continue
+        leaked_to = asns_in_path[asns_in_path.index(leaker) - 1]
+        leak = {
+            'leak_as_path': " ".join(path),
+            'leaked_to': "{}=".format(leaked_to),
+            'leaker_asn': leaker,
+            'start_time': PERIOD_START,
+            'end_time': PERIOD_START,
+        }
+        expected = _reference_path_hops(
+            asns_in_path, asns_in_path.index(leaked_to), factory.get())
+        expected.append((int(leaked_to), 1.0))
+        event = LeakEvent(leak, PERIOD_START, PERIOD_END, factory)
+        assert event.get_accomplices() == expected, (path, leaker)
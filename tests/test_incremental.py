@@ -0,0 +1,105 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from datetime import timedelta
+import copy
+import random
+
+import pytest
+
+from manrs import metrics, settings
+from manrs.incremental import IncrementalState, IncrementalStateError
+
+from helpers import (
+    ASNS, NO_CIDR_RESULTS, PERIOD_END, PERIOD_START, get_bgp_stream_source,
+    get_weight_generator_factory, random_raw_events)
+
+
+def _bgp_stream_results(raw_events, period_start, period_end):
+    source = get_bgp_stream_source(raw_events, period_start, period_end)
+    return source.get_results(get_weight_generator_factory())
+
+
+def _normalised(data):
+    data = copy.deepcopy(data)
+    for record in data:
+        metrics._stringify_datetimes(record)
+    return sorted(data, key=lambda record: sorted(record.items()))
+
+
+def _fold_days(state, raw_events, first_day, last_day, filename):
+    """
+    Fold the days from 'first_day' up to (excluding) 'last_day', saving and
+    loading the state after each of them. Returns the loaded state.
+
+    """
+    day_start = first_day
+    while day_start < last_day:
+        day_end = day_start + timedelta(days=1)
+        state.fold(day_start, day_end, ASNS,
+                   _bgp_stream_results(raw_events, day_start, day_end),
+                   NO_CIDR_RESULTS)
+        state.save(filename)
+        state = IncrementalState.load(filename)
+        day_start = day_end
+    return state
+
+
+def _assert_same_results(folded, full):
+    for asn in ASNS:
+        for metric in ('m1', 'm1c', 'm2', 'm2c'):
+            data_key = "{}_data".format(metric)
+            assert folded[asn][metric] == pytest.approx(full[asn][metric])
+            assert (_normalised(folded[asn][data_key])
+                    == _normalised(full[asn][data_key])), (asn, metric)
+
+
+@pytest.mark.parametrize("only_next_hop", [True, False])
+@pytest.mark.parametrize("storage", ["events", "incidents"])
+def test_folded_days_match_full_period(monkeypatch, tmp_path, storage,
+                                       only_next_hop):
+    monkeypatch.setattr(settings, "DURATION_DATA_STORAGE", storage)
+    monkeypatch.setattr(settings, "ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE",
+                        only_next_hop)
+    raw_events = random_raw_events(random.Random(0), 300, leaks=True)
+    full = metrics.get_results_per_asn(
+        ASNS, _bgp_stream_results(raw_events, PERIOD_START, PERIOD_END),
+        NO_CIDR_RESULTS, {})
+
+    state = _fold_days(IncrementalState(PERIOD_START, PERIOD_END),
+                       raw_events, PERIOD_START, PERIOD_END,
+                       str(tmp_path / "state.json"))
+    _assert_same_results(state.get_results(), full)
+
+
+def test_folded_again_days_match_full_period(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "ASPATH_ONLY_NEXT_HOP_AS_ACCOMPLICE",
+                        False)
+    raw_events = random_raw_events(random.Random(1), 300, leaks=True)
+    full = metrics.get_results_per_asn(
+        ASNS, _bgp_stream_results(raw_events, PERIOD_START, PERIOD_END),
+        NO_CIDR_RESULTS, {})
+
+    # Events starting on the fourth day are reported late, after all the
+    # days were folded; that day and the following ones are folded again.
+    late_start = PERIOD_START + timedelta(days=3)
+    late_end = late_start + timedelta(days=1)
+    reported = [event for event in raw_events
+                if not (late_start.strftime("%Y-%m-%d")
+                        <= event['start_time']
+                        < late_end.strftime("%Y-%m-%d"))]
+    assert len(reported) < len(raw_events)
+    filename = str(tmp_path / "state.json")
+    state = _fold_days(IncrementalState(PERIOD_START, PERIOD_END),
+                       reported, PERIOD_START, PERIOD_END, filename)
+    state = _fold_days(state, raw_events, late_start, PERIOD_END, filename)
+    assert len(state.folded_days) == (PERIOD_END - PERIOD_START).days
+    _assert_same_results(state.get_results(), full)
+
+
+def test_fold_single_days_only():
+    state = IncrementalState(PERIOD_START, PERIOD_END)
+    with pytest.raises(IncrementalStateError):
+        state.fold(PERIOD_START, PERIOD_START + timedelta(days=2), ASNS,
+                   _bgp_stream_results([], PERIOD_START, PERIOD_END),
+                   NO_CIDR_RESULTS)
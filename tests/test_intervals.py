@@ -0,0 +1,40 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from datetime import timedelta
+import random
+
+import pytest
+
+from manrs import metrics
+from manrs.intervals import IncidentIndex
+
+from helpers import (
+    ASNS, DURATION_METRICS, NO_CIDR_RESULTS, PERIOD_END, PERIOD_START,
+    get_bgp_stream_source, get_weight_generator_factory, random_raw_events)
+
+
+def test_window_scores_match_clipped_results():
+    rng = random.Random(0)
+    source = get_bgp_stream_source(
+        random_raw_events(rng, 300, leaks=True, ongoing=True))
+    factory = get_weight_generator_factory()
+    index = IncidentIndex.from_results(
+        ASNS, source.get_results(factory), NO_CIDR_RESULTS)
+
+    half_hours = int((PERIOD_END - PERIOD_START).total_seconds() // 1800)
+    for _ in range(30):
+        window_start = PERIOD_START + timedelta(
+            minutes=30 * rng.randint(0, half_hours - 1))
+        window_end = window_start + timedelta(
+            minutes=30 * rng.randint(1, 48 * 7))
+        window_end = min(window_end, PERIOD_END)
+        expected = metrics.get_results_per_asn(
+            ASNS, source.get_results(factory, window_start, window_end),
+            NO_CIDR_RESULTS, {}, metrics=DURATION_METRICS)
+        scores = index.get_scores(window_start, window_end)
+        for asn in ASNS:
+            for metric in DURATION_METRICS:
+                assert (scores[asn][metric.name]
+                        == pytest.approx(expected[asn][metric.name])), (
+                    asn, metric.name, window_start, window_end)
@@ -0,0 +1,280 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+import copy
+import json
+import multiprocessing
+import os
+import random
+
+import pytest
+
+from manrs import metrics, settings
+from manrs.data_sources.bgpstream import EventRecord
+from manrs.settings import *
+
+SQL_DUMP = os.path.join(os.path.dirname(__file__), "..", "data", "manrs.sql")
+DATA_COLUMNS = ("m1_data", "m1c_data", "m2_data", "m2c_data", "m3_data")
+
+
+def _reference_weighted_duration(events):
+    """
+    The previous implementation rescanning the known incidents for every
+    event, kept as the reference for `_calculate_weighted_duration`.
+
+    """
+    incidents = {}
+    incident_id = 0
+    for event in events:
+        keep_looking = True
+        curr_incident = {
+            'start_time': event['start_time'],
+            'end_time': event['end_time'],
+            'weight': event['weight'],
+        }
+        while keep_looking:
+            for id, incident in incidents.items():
+                if curr_incident['weight'] != incident['weight']:
+                    continue
+                elif (
+                    curr_incident['start_time'] < incident['start_time']
+                    and curr_incident['end_time'] < incident['start_time']
+                    or (curr_incident['start_time'] > incident['end_time']
+                        and curr_incident['end_time'] > incident['end_time'])):
+                    continue
+                elif (curr_incident['start_time'] > incident['start_time']
+                        and curr_incident['end_time'] < incident['end_time']):
+                    keep_looking = False
+                    break
+                else:
+                    curr_incident['start_time'] = min(
+                        curr_incident['start_time'], incident['start_time'])
+                    curr_incident['end_time'] = max(
+                        curr_incident['end_time'], incident['end_time'])
+                    incidents.pop(id)
+                    break
+            else:
+                incidents[incident_id] = curr_incident
+                incident_id += 1
+                keep_looking = False
+
+    scores = []
+    for _, incident in incidents.items():
+        duration = (incident['end_time']
+                    - incident['start_time']).total_seconds()
+        if not duration:
+            continue
+
+        intolerant_num, seconds = divmod(duration, INCIDENT_TOLERANT_DURATION)
+        if intolerant_num:
+            if INCIDENT_INTOLERANT_PENALTY == "exponential":
+                score = 2**intolerant_num
+            else:
+                score = intolerant_num + 1
+        else:
+            if seconds < INCIDENT_ACCEPTABLE_DURATION:
+                score = INCIDENT_ACCEPTABLE_SCORE
+            else:
+                score = INCIDENT_TOLERANT_SCORE
+        score *= incident['weight']
+        scores.append(score)
+
+    return sum(scores)
+
+
+def _parse_isoformat(string):
+    if "." in string:
+        return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S.%f")
+    return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S")
+
+
+def _load_stored_payloads():
+    """
+    Return the non-empty m1-m3 data payloads of the results in the SQL dump
+    with their times parsed.
+
+    """
+    payloads = []
+    with open(SQL_DUMP) as f:
+        columns = None
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("COPY public.results "):
+                columns = line[line.index("(") + 1:line.index(")")].split(
+                    ", ")
+                continue
+            if columns is None:
+                continue
+            if line == "\\.":
+                break
+            row = dict(zip(columns, line.split("\t")))
+            for column in DATA_COLUMNS:
+                events = json.loads(row[column])
+                for event in events:
+                    event['start_time'] = _parse_isoformat(
+                        event['start_time'])
+                    event['end_time'] = _parse_isoformat(event['end_time'])
+                if events:
+                    payloads.append(events)
+    return payloads
+
+
+def _random_events(rng, num):
+    """
+    Return random events on a coarse time grid so that many of them overlap
+    or touch at their edges.
+
+    """
+    base = datetime(2018, 5, 1)
+    events = []
+    for _ in range(num):
+        start = base + timedelta(minutes=30 * rng.randint(0, 200))
+        end = start + timedelta(minutes=30 * rng.randint(0, 12))
+        events.append({
+            'start_time': start,
+            'end_time': end,
+            'weight': rng.choice([1.0, 0.5, 0.25]),
+        })
+    return events
+
+
+def _assert_same_scores(events_lists):
+    expected = [_reference_weighted_duration(copy.deepcopy(events))
+                for events in events_lists]
+    single = [metrics._calculate_weighted_duration(copy.deepcopy(events))
+              for events in events_lists]
+    batch = metrics._calculate_weighted_durations(
+        copy.deepcopy(events_lists))
+    assert single == pytest.approx(expected)
+    assert batch == pytest.approx(expected)
+
+
+def test_stored_payloads():
+    payloads = _load_stored_payloads()
+    assert payloads
+    _assert_same_scores(payloads)
+
+
+def test_random_events():
+    rng = random.Random(0)
+    _assert_same_scores(
+        [_random_events(rng, rng.randint(1, 60)) for _ in range(300)])
+
+
+def test_touching_events():
+    start = datetime(2018, 5, 1)
+    hour = timedelta(hours=1)
+    events = [
+        {'start_time': start, 'end_time': start + hour, 'weight': 1.0},
+        {'start_time': start + 2 * hour, 'end_time': start + 3 * hour,
+         'weight': 1.0},
+        {'start_time': start + hour, 'end_time': start + 2 * hour,
+         'weight': 1.0},
+        {'start_time': start + hour, 'end_time': start + hour,
+         'weight': 0.5},
+    ]
+    _assert_same_scores([events])
+    assert len(metrics._merge_incidents(events)) == 2
+
+
+def test_incidents_storage(monkeypatch):
+    monkeypatch.setattr(settings, "DURATION_DATA_STORAGE", "incidents")
+    rng = random.Random(1)
+    events_lists = _load_stored_payloads() + [
+        _random_events(rng, rng.randint(1, 60)) for _ in range(100)]
+    for index, events in enumerate(events_lists):
+        for event in events:
+            event.setdefault('bgpstream_eventid', index)
+    metric = metrics.WeightedDurationMetric('m1', 'bgp_stream', None)
+    expected_data = [metric.get_stored_data(copy.deepcopy(events))
+                     for events in events_lists]
+    expected = metrics.WeightedDurationMetric.calculate_batch(
+        [(metric, copy.deepcopy(events)) for events in events_lists])
+    values, stored_data = (
+        metrics.WeightedDurationMetric.calculate_and_store_batch(
+            [(metric, events) for events in events_lists]))
+    assert values == pytest.approx(expected)
+    assert stored_data == expected_data
+
+
+def _random_source_results(rng, asns):
+    """
+    Return BGPStream and CIDR report results with random events for the
+    given ASNs.
+
+    """
+    bgp_stream_results = {}
+    for event_type in ('bgp_leak', 'bgp_hijack'):
+        events = []
+        culprits = []
+        accomplices = []
+        for index, event in enumerate(_random_events(rng, 200)):
+            duration = int((event['end_time']
+                            - event['start_time']).total_seconds())
+            events.append(EventRecord(
+                '10.0.{}.0/24'.format(index), event['start_time'],
+                event['end_time'], duration, index))
+            culprits.append((index, rng.choice(asns), 1.0))
+            for _ in range(rng.randint(0, 3)):
+                accomplices.append(
+                    (index, rng.choice(asns), event['weight']))
+        bgp_stream_results[event_type] = {
+            'events': events,
+            'culprits': culprits,
+            'accomplices': accomplices,
+        }
+    culprits = {}
+    for event in _random_events(rng, 200):
+        event['prefix'] = '192.0.2.0/24'
+        culprits.setdefault(rng.choice(asns), []).append(event)
+    cidr_results = {'bogon_prefixes': {'culprits': culprits}}
+    return bgp_stream_results, cidr_results
+
+
+@pytest.mark.parametrize("start_method", ["fork", "forkserver", "spawn"])
+@pytest.mark.parametrize("storage", ["events", "incidents"])
+def test_sharded_matches_single_process(monkeypatch, storage, start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip("No '{}' start method".format(start_method))
+    monkeypatch.setattr(metrics, "ProcessPoolExecutor", partial(
+        ProcessPoolExecutor,
+        mp_context=multiprocessing.get_context(start_method)))
+    # Settings differing from `manrs.settings` need to reach the workers.
+    monkeypatch.setattr(settings, "DURATION_DATA_STORAGE", storage)
+    monkeypatch.setattr(metrics, "INCIDENT_INTOLERANT_PENALTY",
+                        "exponential")
+    monkeypatch.setattr(metrics, "INCIDENT_TOLERANT_DURATION", 3600)
+    asns = list(range(1, 31))
+    rng = random.Random(2)
+    bgp_stream_results, cidr_results = _random_source_results(rng, asns)
+    single = metrics.get_results_per_asn(
+        set(asns), copy.deepcopy(bgp_stream_results),
+        copy.deepcopy(cidr_results), {})
+    sharded = metrics.get_results_per_asn(
+        set(asns), copy.deepcopy(bgp_stream_results),
+        copy.deepcopy(cidr_results), {}, workers=3)
+    assert set(sharded) == set(single)
+    for asn in asns:
+        assert set(sharded[asn]) == set(single[asn])
+        for key, value in single[asn].items():
+            if isinstance(value, float):
+                assert sharded[asn][key] == pytest.approx(value), (asn, key)
+            else:
+                assert sharded[asn][key] == value, (asn, key)
+
+
+@pytest.mark.parametrize("storage", ["events", "incidents"])
+def test_stored_data_serialise(monkeypatch, storage):
+    monkeypatch.setattr(settings, "DURATION_DATA_STORAGE", storage)
+    asns = list(range(1, 31))
+    bgp_stream_results, cidr_results = _random_source_results(
+        random.Random(3), asns)
+    results = metrics.get_results_per_asn(
+        set(asns), bgp_stream_results, cidr_results, {})
+    for asn in asns:
+        for column in DATA_COLUMNS:
+            # The data are stored in JSONB columns.
+            json.dumps(results[asn][column])
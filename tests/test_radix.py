@@ -0,0 +1,64 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import ipaddress
+import random
+
+from manrs.radix import PrefixIndex
+
+
+def _random_network(rng, version):
+    """
+    Return a random network from a small address space so that the networks
+    of a set often overlap.
+
+    """
+    if version == 4:
+        bits = 32
+        address = rng.choice([10, 11, 192]) << 24 | rng.getrandbits(16) << 8
+    else:
+        bits = 128
+        address = 0x2001 << 112 | rng.choice([0xdb8, 0xdb9]) << 96 | (
+            rng.getrandbits(16) << 80)
+    length = rng.choice([0, 1, 8, 9, 16, 20, 24, 25, 32, 48, bits])
+    length = min(length, bits)
+    return ipaddress.ip_network((address, length), strict=False)
+
+
+def _reference_overlaps_other(networks, network):
+    return any(x.overlaps(network) and x != network for x in networks)
+
+
+def _assert_parity(networks, queries):
+    index = PrefixIndex(networks)
+    for network in queries:
+        assert index.overlaps_other(network) == _reference_overlaps_other(
+            networks, network), network
+
+
+def test_random_sets():
+    rng = random.Random(0)
+    for _ in range(300):
+        networks = [_random_network(rng, rng.choice([4, 6]))
+                    for _ in range(rng.randint(0, 30))]
+        # Duplicates of indexed networks
+        networks += rng.sample(networks, min(len(networks), 3))
+        queries = [_random_network(rng, rng.choice([4, 6]))
+                   for _ in range(30)]
+        _assert_parity(networks, queries + networks)
+
+
+def test_default_routes():
+    networks = [ipaddress.ip_network("0.0.0.0/0"),
+                ipaddress.ip_network("2001:db8::/32")]
+    queries = [
+        ipaddress.ip_network("0.0.0.0/0"),
+        ipaddress.ip_network("10.0.0.0/8"),
+        ipaddress.ip_network("::/0"),
+        ipaddress.ip_network("2001:db8::/32"),
+        ipaddress.ip_network("2001:db8:1::/48"),
+        ipaddress.ip_network("2001:db9::/32"),
+    ]
+    _assert_parity(networks, queries)
+    _assert_parity([ipaddress.ip_network("::/0")], queries)
+    _assert_parity([], queries)
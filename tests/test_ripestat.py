@@ -0,0 +1,270 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+from datetime import date, timedelta
+import json
+import random
+
+import pytest
+
+from manrs import settings
+from manrs.data_sources import ripestat
+from manrs.data_sources.ripestat import (
+    AdaptiveLimiter, RIPEstatCheckpoint, RIPEstatIncompleteDataError,
+    RIPEstatSourceData)
+
+URL = "https://stat.ripe.net/data/whois/data.json?resource=AS1"
+WHOIS = {'data': {'authorities': ['ripe'],
+                  'records': [[{'key': 'admin-c', 'value': "X"}]]}}
+
+
+def _drive(limiter, responses, clock):
+    """
+    Feed the (kind, latency, error) responses to the limiter as if they
+    completed one after the other with the limit fully used.
+
+    """
+    for kind, latency, error in responses:
+        clock[0] += latency
+        limiter.in_flight = int(limiter.limit) - 1
+        limiter._adapt(latency, error, kind)
+
+
+def _patch_clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(ripestat, "default_timer", lambda: clock[0])
+    return clock
+
+
+def test_mixed_latencies(monkeypatch):
+    clock = _patch_clock(monkeypatch)
+    rng = random.Random(0)
+    limiter = AdaptiveLimiter(8, 1, 64)
+    responses = []
+    for _ in range(2000):
+        if rng.random() < 0.5:
+            responses.append(('whois', rng.uniform(0.02, 0.03), False))
+        else:
+            responses.append(('as-routing-consistency',
+                              rng.uniform(0.05, 0.4), False))
+    _drive(limiter, responses, clock)
+    # Healthy responses of slow data calls do not throttle the fast ones.
+    assert limiter.limit > 32
+
+
+def test_congestion(monkeypatch):
+    clock = _patch_clock(monkeypatch)
+    limiter = AdaptiveLimiter(32, 1, 64)
+    _drive(limiter, [('whois', 0.02, False)] * 10, clock)
+    limit = limiter.limit
+    _drive(limiter, [('whois', 0.2, False)] * 10, clock)
+    assert limiter.limit < limit
+    limit = limiter.limit
+    _drive(limiter, [('whois', 0.02, True)], clock)
+    assert limiter.limit == limit * AdaptiveLimiter.ERROR_DECREASE
+    _drive(limiter, [('whois', 0.02, True)] * 100, clock)
+    assert limiter.limit == 1
+
+
+class _FakeResponse(object):
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+class _FakeSession(object):
+    """
+    Answers the requests with the given responses, in order.
+
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, url, headers=None):
+        self.requests += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def _get_source(monkeypatch, asns=(1,), **kwargs):
+    """
+    Return a RIPEstat data source for the ASNs' whois data whose retry
+    delays are recorded instead of waited for.
+
+    """
+    monkeypatch.setattr(settings, "RIPESTAT_REQUESTS_PER_SECOND", 0)
+    source = RIPEstatSourceData(list(asns), data_calls=['whois'], **kwargs)
+    source.delays = []
+    get_retry_delay = source._get_retry_delay
+
+    def _record_delay(attempt, retry_after=None):
+        source.delays.append(get_retry_delay(attempt, retry_after))
+        return 0
+
+    monkeypatch.setattr(source, "_get_retry_delay", _record_delay)
+    return source
+
+
+def _fetch(loop, source, session):
+    return loop.run_until_complete(
+        source._fetch_url(session, URL, 1, 'whois'))
+
+
+def test_server_errors_are_retried(monkeypatch, loop):
+    source = _get_source(monkeypatch)
+    session = _FakeSession([
+        _FakeResponse(500),
+        _FakeResponse(503),
+        _FakeResponse(200, json.dumps(WHOIS)),
+    ])
+    assert _fetch(loop, source, session)[2] == WHOIS
+    assert session.requests == 3
+    assert len(source.delays) == 2
+    assert not source.failures
+
+
+def test_retries_run_out(monkeypatch, loop):
+    source = _get_source(monkeypatch)
+    session = _FakeSession(
+        [_FakeResponse(500)] * RIPEstatSourceData.RETRIES)
+    assert _fetch(loop, source, session)[2] is None
+    assert session.requests == RIPEstatSourceData.RETRIES
+    assert len(source.delays) == RIPEstatSourceData.RETRIES - 1
+    assert source.failures == {(1, 'whois'): "HTTP 500"}
+
+
+def test_client_errors_are_not_retried(monkeypatch, loop):
+    source = _get_source(monkeypatch)
+    session = _FakeSession([_FakeResponse(404)])
+    assert _fetch(loop, source, session)[2] is None
+    assert session.requests == 1
+    assert source.failures == {(1, 'whois'): "HTTP 404"}
+
+
+def test_invalid_json_is_retried(monkeypatch, loop):
+    source = _get_source(monkeypatch)
+    session = _FakeSession([
+        _FakeResponse(200, '{"data": '),
+        _FakeResponse(200, json.dumps(WHOIS)),
+    ])
+    assert _fetch(loop, source, session)[2] == WHOIS
+    assert session.requests == 2
+    assert not source.failures
+
+
+def test_retry_after(monkeypatch, loop):
+    source = _get_source(monkeypatch)
+    session = _FakeSession([
+        _FakeResponse(429, headers={'Retry-After': "7"}),
+        _FakeResponse(503, headers={'Retry-After': "3600"}),
+        _FakeResponse(503, headers={
+            'Retry-After': "Wed, 21 Oct 2015 07:28:00 GMT"}),
+        _FakeResponse(200, json.dumps(WHOIS)),
+    ])
+    assert _fetch(loop, source, session)[2] == WHOIS
+    # Capped at the maximum delay; dates fall back to the backoff.
+    assert source.delays[:2] == [7, RIPEstatSourceData.RETRY_MAX_DELAY]
+    assert (0 <= source.delays[2]
+            <= RIPEstatSourceData.RETRY_BASE_DELAY * 2 ** 2)
+
+
+def test_backoff_grows_up_to_the_maximum():
+    source = RIPEstatSourceData([1], data_calls=['whois'])
+    random.seed(0)
+    for attempt in range(10):
+        bound = min(RIPEstatSourceData.RETRY_MAX_DELAY,
+                    RIPEstatSourceData.RETRY_BASE_DELAY * 2 ** attempt)
+        delays = [source._get_retry_delay(attempt) for _ in range(100)]
+        assert all(0 <= delay <= bound for delay in delays)
+        assert max(delays) > bound / 2
+
+
+@pytest.mark.parametrize("num_failures,fails", [(2, False), (3, True)])
+def test_report_failures(num_failures, fails):
+    source = RIPEstatSourceData(list(range(1, 201)), data_calls=['whois'])
+    source.failures = {(asn, 'whois'): "HTTP 500"
+                       for asn in range(1, num_failures + 1)}
+    # 2 of the 200 requests is the RIPESTAT_MAX_FAILURE_RATIO.
+    if fails:
+        with pytest.raises(RIPEstatIncompleteDataError):
+            source._report_failures()
+    else:
+        source._report_failures()
+
+
+def _patch_fetch_url(monkeypatch, source, failing=()):
+    """
+    Answer the source's requests without RIPEstat, failing for the given
+    ASNs. Returns the list of the fetched ASNs.
+
+    """
+    fetched = []
+
+    async def _fetch_url(session, url, asn, data_call):
+        fetched.append(asn)
+        if asn in failing:
+            source.failures[(asn, data_call)] = "HTTP 500"
+            return (asn, data_call, None, source.checked_on)
+        return (asn, data_call, WHOIS, source.checked_on)
+
+    monkeypatch.setattr(source, "_check_data_call_version", lambda: None)
+    monkeypatch.setattr(source, "_fetch_url", _fetch_url)
+    return fetched
+
+
+def test_checkpoint_resumes_failed_run(monkeypatch, loop, tmp_path):
+    filename = str(tmp_path / "checkpoint.jsonl")
+    asns = list(range(1, 11))
+    source = _get_source(monkeypatch, asns,
+                         checkpoint=RIPEstatCheckpoint(filename))
+    fetched = _patch_fetch_url(monkeypatch, source, failing={3, 4})
+    with pytest.raises(RIPEstatIncompleteDataError):
+        source.fetch_data()
+    assert sorted(fetched) == asns
+
+    source = _get_source(monkeypatch, asns,
+                         checkpoint=RIPEstatCheckpoint(filename))
+    fetched = _patch_fetch_url(monkeypatch, source)
+    source.fetch_data()
+    assert sorted(fetched) == [3, 4]
+    assert all(results['contact_info']['has_contact_info']
+               for results in source.get_results().values())
+    # The checkpoint is removed once all the data are gathered.
+    assert not (tmp_path / "checkpoint.jsonl").exists()
+
+
+def test_checkpoint_skips_other_and_expired_results(monkeypatch, tmp_path):
+    filename = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = RIPEstatCheckpoint(filename)
+    expired = date.today() - timedelta(
+        seconds=settings.RIPESTAT_CACHE_TTL['whois'] + 86400)
+    for asn, checked_on in [(1, date.today()), (2, expired),
+                            (3, date.today())]:
+        checkpoint.add(asn, 'whois', {'has_contact_info': True,
+                                      'checked_on': checked_on.isoformat()})
+    checkpoint.close()
+    # The incomplete last line of an interrupted run is skipped.
+    with open(filename, 'a') as f:
+        f.write('{"asn": 4, "data_call": "wh')
+    assert list(checkpoint.load([1, 2, 4], ['whois'])) == [1]
+    assert checkpoint.load([1, 2], ['as_routing_consistency']) == {}
@@ -0,0 +1,62 @@
+# Copyright: 2018, ISOC and the MANRS benchmarking tool contributors
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import random
+
+import pytest
+
+from manrs import metrics
+from manrs.scenarios import SCORING_SETTINGS, get_scenarios, sweep
+from manrs.util import WeightGeneratorFactory
+
+from helpers import (
+    ASNS, DURATION_METRICS, NO_CIDR_RESULTS, get_bgp_stream_source,
+    random_raw_events)
+
+
+def _get_scores(source, scenario):
+    """
+    Calculate the duration based metrics of a scenario on their own, with
+    its scoring settings given explicitly.
+
+    """
+    factory = WeightGeneratorFactory(
+        scenario['WEIGHT_GENERATOR_TYPE'],
+        scenario['WEIGHT_GENERATOR_START'],
+        scenario['WEIGHT_GENERATOR_INTERVAL'],
+        scenario['WEIGHT_GENERATOR_END'])
+    buckets = {asn: {metric.data_key: metric.new_data()
+                     for metric in DURATION_METRICS}
+               for asn in ASNS}
+    metrics._dispatch(ASNS, buckets, {
+        'bgp_stream': source.get_results(factory),
+        'cidr': NO_CIDR_RESULTS,
+    }, DURATION_METRICS)
+    owners = [(asn, metric) for asn in ASNS for metric in DURATION_METRICS]
+    scores = metrics._calculate_weighted_durations(
+        [buckets[asn][metric.data_key] for asn, metric in owners],
+        scoring={name: scenario[name] for name in SCORING_SETTINGS})
+    results = {asn: {} for asn in ASNS}
+    for (asn, metric), score in zip(owners, scores):
+        results[asn][metric.name] = score
+    return results
+
+
+def test_sweep_matches_scenarios_on_their_own():
+    source = get_bgp_stream_source(
+        random_raw_events(random.Random(0), 300, leaks=True))
+    scenarios = get_scenarios({
+        'INCIDENT_INTOLERANT_PENALTY': ["linear", "exponential"],
+        'INCIDENT_TOLERANT_DURATION': [3600, 86400],
+        'WEIGHT_GENERATOR_INTERVAL': [0.5, 0.25],
+    })
+    assert len(scenarios) == 8
+    all_results = sweep(ASNS, source, NO_CIDR_RESULTS, scenarios)
+
+    for scenario, results in zip(scenarios, all_results):
+        expected = _get_scores(source, scenario)
+        for asn in ASNS:
+            for metric in DURATION_METRICS:
+                assert (results[asn][metric.name]
+                        == pytest.approx(expected[asn][metric.name])), (
+                    scenario, asn, metric.name)